@@ -1,6 +1,19 @@
+import atexit
+import sys
 from django.apps import AppConfig
 
 
+def _close_database_connections():
+    # Only close the pooled connections if 'explorer.database' was used, so
+    # management commands never import it just to exit
+    database = sys.modules.get("explorer.database")
+    if database is not None:
+        database.close_all_connections()
+
+
 class MapConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "explorer"
+
+    def ready(self):
+        atexit.register(_close_database_connections)
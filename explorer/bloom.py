@@ -0,0 +1,102 @@
+"""
+This module is used to test if grid cells may have records before looking
+them up
+
+A Bloom filter never misses a cell which was added, but may report a small
+share ('error_rate') of other cells as present. Cells reported as absent are
+therefore empty for sure and need no lookup.
+"""
+import math
+import numpy as np
+
+__all__ = ["BloomFilter"]
+
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _splitmix64(keys):
+    z = keys + _GOLDEN_GAMMA
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+class BloomFilter:
+    """This class is used to keep a compact set of int64 keys.
+
+    :param capacity: The expected number of keys.
+    :type capacity: int
+
+    :param error_rate: The expected share of absent keys reported as present
+        when the filter holds 'capacity' keys.
+    :type error_rate: float
+    """
+
+    def __init__(self, capacity, error_rate=0.01, bits=None, number_of_hashes=None, count=0):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        if bits is None:
+            size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+            bits = np.zeros((size + 7) // 8, dtype=np.uint8)
+        if number_of_hashes is None:
+            number_of_hashes = max(round(len(bits) * 8 / self.capacity * math.log(2)), 1)
+        self.bits = bits
+        self.size = len(bits) * 8
+        self.number_of_hashes = int(number_of_hashes)
+        self.count = int(count)
+
+    def _positions(self, keys):
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1).view(np.uint64)
+        first = _splitmix64(keys)
+        second = _splitmix64(first) | np.uint64(1)
+        hashes = np.arange(self.number_of_hashes, dtype=np.uint64)
+        return (first[:, None] + hashes[None, :] * second[:, None]) % np.uint64(self.size)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        self.count += len(np.asarray(keys).reshape(-1))
+
+    def contains(self, keys):
+        """This method is used to test a set of keys.
+
+        :return: False for the keys which were never added, True for the keys
+            which were added and for a few others.
+        :rtype: numpy.ndarray of bool"""
+
+        positions = self._positions(keys)
+        is_set = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return is_set.all(axis=1)
+
+    def save(self, path, **metadata):
+        np.savez(path, bits=self.bits, capacity=self.capacity, error_rate=self.error_rate,
+                 number_of_hashes=self.number_of_hashes, count=self.count, **metadata)
+
+    @classmethod
+    def load(cls, path):
+        """This method is used to load a filter saved by 'save'.
+
+        :return: The filter and the other saved values.
+        :rtype: tuple of BloomFilter and dict"""
+
+        with np.load(path) as file:
+            data = {name: file[name] for name in file.files}
+        bloom_filter = cls(capacity=int(data.pop("capacity")),
+                           error_rate=float(data.pop("error_rate")),
+                           bits=data.pop("bits"),
+                           number_of_hashes=int(data.pop("number_of_hashes")),
+                           count=int(data.pop("count")))
+        return bloom_filter, {name: value.item() for name, value in data.items()}
+
+
+def test_BloomFilter():
+    bloom_filter = BloomFilter(capacity=10000)
+    keys = np.arange(10000, dtype=np.int64) * 7919
+    bloom_filter.add(keys)
+    print(bloom_filter.contains(keys).all())
+    print(bloom_filter.contains(keys + 1).mean())
+
+if __name__ == "__main__":
+    # test_BloomFilter()
+    pass
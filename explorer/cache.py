@@ -0,0 +1,431 @@
+"""
+This module is used to cache risk results of routes and of grid cells
+
+A route is keyed by a hash of its canonical cell set, i.e. the sorted unique
+keys of the grid cells it crosses, so the same route gives the same key no
+matter how the frontend sampled its polyline. A grid cell is keyed by its cell
+key, so overlapping routes share the lookups of their common cells. Cached
+results are dropped when the data version of the database changes, i.e. after
+an update run.
+
+Identical route requests which arrive at the same time are coalesced, so only
+the first one computes the risk and the others share its result.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+__all__ = ["MemoryBackend", "DjangoCacheBackend", "RouteCache", "CellCache", "SingleFlight"]
+
+
+ROUTE_CACHE_BACKEND = os.getenv("ROUTE_CACHE_BACKEND", "memory")
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "256"))
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", "3600")) # seconds
+CELL_CACHE_SIZE = int(os.getenv("CELL_CACHE_SIZE", "100000"))
+# The data version is checked at most once in this interval on cell lookups
+CELL_CACHE_VERSION_INTERVAL = float(os.getenv("CELL_CACHE_VERSION_INTERVAL", "1")) # seconds
+# Followers of a computation stop waiting for its leader after this timeout
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv("SINGLE_FLIGHT_TIMEOUT", "30")) # seconds
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """This class is used to keep cached values in the memory of the worker
+        process with LRU eviction and a time to live."""
+
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE, ttl=ROUTE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class DjangoCacheBackend:
+    """This class is used to keep cached values in a cache of Django's cache
+        framework, which can be shared by every worker. Eviction is left to
+        the cache and stale data versions are never read again because the
+        version is part of every key."""
+
+    def __init__(self, alias="default", ttl=ROUTE_CACHE_TTL, prefix="route_risk"):
+        from django.core.cache import caches
+        self._cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self._cache.get(f"{self.prefix}:{key}")
+
+    def set(self, key, value):
+        self._cache.set(f"{self.prefix}:{key}", value, timeout=self.ttl)
+
+    def clear(self):
+        pass
+
+class RouteCache:
+    """This class is used to cache the risk results of routes.
+
+    :param get_version: A function returning the current data version, e.g.
+        'explorer.database.data_version'.
+    :type get_version: callable
+
+    :param backend: The backend keeping the values. By default, the backend
+        named by the environment variable 'ROUTE_CACHE_BACKEND', either
+        'memory' or 'django'.
+    :type backend: MemoryBackend or DjangoCacheBackend
+    """
+
+    def __init__(self, get_version, backend=None):
+        if backend is None:
+            if ROUTE_CACHE_BACKEND == "django":
+                backend = DjangoCacheBackend()
+            else:
+                backend = MemoryBackend()
+        self.backend = backend
+        self._get_version = get_version
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, *cells, **options):
+        """This method is used to determine the key of a route.
+
+        :param *cells: The cell keys of each grid of the route.
+        :type *cells: numpy.ndarray
+
+        :param **options: Other options the result depends on, e.g. buffer_m.
+
+        :return: The hash of the data version, the options and the canonical
+            cell sets.
+        :rtype: str"""
+
+        version = self._check_version()
+        digest = hashlib.sha1(f"{version}:{sorted(options.items())}".encode())
+        for keys in cells:
+            keys = np.unique(np.asarray(keys, dtype=np.int64))
+            digest.update(len(keys).to_bytes(8, "little"))
+            digest.update(keys.tobytes())
+        return digest.hexdigest()
+
+    def _check_version(self):
+        version = self._get_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    if self._version is not None:
+                        self.backend.clear()
+                        self.invalidations += 1
+                    self._version = version
+        return version
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        stats = {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else None,
+            "invalidations": self.invalidations,
+            "version": self._version,
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats["size"] = len(self.backend)
+            stats["maxsize"] = self.backend.maxsize
+            stats["evictions"] = self.backend.evictions
+            stats["expirations"] = self.backend.expirations
+        return stats
+
+class CellCache:
+    """This class is used to cache the data of single grid cells in an LRU
+        dictionary of the worker process.
+
+    Empty cells are cached as well (negative caching) with the value None,
+    since most cells of a route have no records at all.
+
+    :param get_version: A function returning the current data version, e.g.
+        'explorer.database.data_version'.
+    :type get_version: callable
+
+    :param maxsize: The maximum number of cached cells.
+    :type maxsize: int
+    """
+
+    def __init__(self, get_version, maxsize=CELL_CACHE_SIZE,
+                 version_interval=CELL_CACHE_VERSION_INTERVAL):
+        self.maxsize = maxsize
+        self.version_interval = version_interval
+        self._get_version = get_version
+        self._version = None
+        self._checked_at = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.version_interval:
+            return
+        version = self._get_version()
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                if self._version is not None:
+                    self._data.clear()
+                    self.invalidations += 1
+                self._version = version
+
+    def get_many(self, cells):
+        """This method is used to get the cached data of a set of cells.
+
+        :param cells: keys of grid cells
+        :type cells: iterable of int
+
+        :return: The cached data of each found cell (None for empty cells)
+            and the keys of the cells which are not cached.
+        :rtype: tuple of dict and list"""
+
+        self._check_version()
+        found = {}
+        missing = []
+        with self._lock:
+            for cell in cells:
+                cell = int(cell)
+                value = self._data.get(cell, _MISSING)
+                if value is _MISSING:
+                    missing.append(cell)
+                    continue
+                self._data.move_to_end(cell)
+                found[cell] = value
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+            self.misses += len(missing)
+        return found, missing
+
+    def set_many(self, values):
+        """This method is used to cache the data of a set of cells.
+
+        :param values: The data of each cell, None for empty cells.
+        :type values: dict"""
+
+        with self._lock:
+            for cell, value in values.items():
+                self._data[int(cell)] = value
+                self._data.move_to_end(int(cell))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        requests = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.negative_hits) / requests if requests else None,
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "version": self._version,
+        }
+
+class SingleFlight:
+    """This class is used to coalesce concurrent computations of the same
+        key, e.g. of a route cache key, in threads and in asyncio alike.
+
+    The first caller of a key (the leader) computes the value while the
+    others (the followers) wait for the leader and share its value. If the
+    leader fails, every follower gets the same exception.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    def begin(self, key):
+        """This method is used to join the computation of a key.
+
+        :return: The future of the value and whether the caller is the leader,
+            who must call 'finish' or 'fail' with the key afterwards.
+        :rtype: tuple of concurrent.futures.Future and bool"""
+
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, value):
+        with self._lock:
+            future = self._flights.pop(key)
+        try:
+            future.set_result(value)
+        except concurrent.futures.InvalidStateError:
+            # Only if the shared future was cancelled, see 'wait'
+            pass
+
+    def fail(self, key, exception):
+        with self._lock:
+            future = self._flights.pop(key)
+            self.failures += 1
+        try:
+            future.set_exception(exception)
+        except concurrent.futures.InvalidStateError:
+            pass
+
+    @staticmethod
+    async def wait(future, timeout=None):
+        """This method is used by async followers to wait for the value of
+            the leader. A cancelled follower, e.g. of a closed connection,
+            does not cancel the future the other followers wait for.
+
+        :type future: concurrent.futures.Future
+
+        :param timeout: The seconds to wait before raising TimeoutError, or
+            None to wait until the leader is done.
+        :type timeout: float"""
+
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+    async def ado(self, key, function, *args):
+        """This method is used to compute the value of a key in asyncio, e.g.
+            ado(key, function, *args) returns await function(*args). Threads
+            use 'begin' and 'finish' or 'fail' instead, see
+            'explorer.views.stream_map_risk'."""
+
+        future, is_leader = self.begin(key)
+        if not is_leader:
+            return await self.wait(future)
+        try:
+            value = await function(*args)
+        except BaseException as e:
+            self.fail(key, e if isinstance(e, Exception) else RuntimeError(f"The computation of {key} is cancelled"))
+            raise
+        self.finish(key, value)
+        return value
+
+    def stats(self):
+        requests = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_rate": self.coalesced / requests if requests else None,
+            "failures": self.failures,
+            "in_flight": len(self._flights),
+        }
+
+
+def test_RouteCache():
+    cache = RouteCache(get_version=lambda: 1, backend=MemoryBackend(maxsize=1))
+    key = cache.key(np.array([3, 1, 2]), np.array([1]), buffer_m=0)
+    print(cache.get(key))
+    cache.set(key, {"traffic_accident_number": 1})
+    print(cache.get(cache.key(np.array([1, 2, 3, 3]), np.array([1]), buffer_m=0)))
+    print(cache.stats())
+
+def test_CellCache():
+    cache = CellCache(get_version=lambda: 1, maxsize=2)
+    print(cache.get_many([1, 2, 3]))
+    cache.set_many({1: (1, 25.0338, 121.5646), 2: None, 3: None})
+    print(cache.get_many([1, 2, 3]))
+    print(cache.stats())
+
+def test_SingleFlight():
+    single_flight = SingleFlight()
+
+    async def compute(value):
+        await asyncio.sleep(0.1)
+        return value
+
+    async def main():
+        return await asyncio.gather(*[single_flight.ado("route", compute, i) for i in range(10)])
+
+    async def cancel_follower():
+        # The other followers still get the value of the leader
+        tasks = [asyncio.ensure_future(single_flight.ado("route", compute, i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(asyncio.run(main()))
+    print(asyncio.run(cancel_follower()))
+    def compute_in_thread(value):
+        future, is_leader = single_flight.begin("route")
+        if not is_leader:
+            return future.result()
+        time.sleep(0.1)
+        single_flight.finish("route", value)
+        return value
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        print(list(executor.map(compute_in_thread, range(10))))
+    print(single_flight.stats())
+
+if __name__ == "__main__":
+    # test_RouteCache()
+    # test_CellCache()
+    # test_SingleFlight()
+    pass
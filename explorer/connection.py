@@ -0,0 +1,168 @@
+"""
+This module is used to reuse SQLite connections across SQLController objects
+
+Each thread opens one connection per database file and keeps it, instead of
+opening a new connection for every controller. Connections are opened in WAL
+journal mode, so an update run writing the database does not block the
+readers, and with the read tuning PRAGMAs below.
+
+Worker processes should call 'close_all' when they exit, see
+'explorer.apps' and 'gunicorn.conf.py'. A process forked from a process with
+open connections opens its own connections instead of sharing them.
+"""
+import os
+import sqlite3
+import threading
+
+__all__ = ["ConnectionPool"]
+
+
+# Negative values are in KiB, positive values are in pages
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))) # bytes
+# 'DEFAULT', 'FILE' or 'MEMORY'
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY").upper()
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5")) # seconds
+# The number of prepared statements each connection keeps, see 'explorer.query'
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+
+class ConnectionPool:
+    """This class is used to keep one SQLite connection per thread and
+        database file.
+
+    :param cache_size: PRAGMA cache_size of each connection.
+    :type cache_size: int
+
+    :param mmap_size: PRAGMA mmap_size of each connection.
+    :type mmap_size: int
+
+    :param temp_store: PRAGMA temp_store of each connection.
+    :type temp_store: str
+    """
+
+    def __init__(self, cache_size=SQLITE_CACHE_SIZE, mmap_size=SQLITE_MMAP_SIZE,
+                 temp_store=SQLITE_TEMP_STORE, timeout=SQLITE_BUSY_TIMEOUT,
+                 cached_statements=SQLITE_CACHED_STATEMENTS):
+        if temp_store not in ("DEFAULT", "FILE", "MEMORY"):
+            raise ValueError(f"Invalid temp_store: {temp_store}")
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.temp_store = temp_store
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+
+    def _connect(self, path):
+        # Connections may be closed by 'close_all' from another thread, but
+        # are only used by the thread which opened them
+        conn = sqlite3.connect(path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute(f"PRAGMA temp_store={self.temp_store}")
+        return conn
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # Never use the connections of the parent process
+            with self._lock:
+                self._pid = os.getpid()
+                self._connections = set()
+            self._local = threading.local()
+
+    def connection(self, path):
+        """This method is used to get the connection of the current thread to
+            a database file, which is opened on the first call. Every call
+            must be followed by 'release' once the connection is not used.
+
+        :rtype: sqlite3.Connection"""
+
+        self._check_fork()
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+            self._local.users = {}
+        conn = connections.get(path)
+        if conn is None:
+            conn = connections[path] = self._connect(path)
+            with self._lock:
+                self._connections.add(conn)
+                self.opened += 1
+        else:
+            self.reused += 1
+        self._local.users[conn] = self._local.users.get(conn, 0) + 1
+        return conn
+
+    def release(self, conn):
+        """This method is used when a controller is closed. When no other
+            controller of the thread uses the connection, uncommitted changes
+            are rolled back as if the connection were closed, but the
+            connection stays open."""
+
+        users = getattr(self._local, "users", {})
+        users[conn] = users.get(conn, 1) - 1
+        if users[conn] <= 0:
+            users.pop(conn)
+            if conn.in_transaction:
+                conn.rollback()
+
+    def close(self):
+        """This method is used to close the connections of the current
+            thread, e.g. when a thread finishes."""
+
+        self._check_fork()
+        connections = getattr(self._local, "connections", None) or {}
+        for conn in connections.values():
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+        connections.clear()
+        getattr(self._local, "users", {}).clear()
+
+    def close_all(self):
+        """This method is used to close the connections of every thread when
+            the worker process exits."""
+
+        self._check_fork()
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def stats(self):
+        return {
+            "connections": len(self._connections),
+            "opened": self.opened,
+            "reused": self.reused,
+            "cache_size": self.cache_size,
+            "mmap_size": self.mmap_size,
+            "temp_store": self.temp_store,
+        }
+
+
+def test_ConnectionPool():
+    pool = ConnectionPool()
+    path = ":memory:"
+    conn = pool.connection(path)
+    print(conn is pool.connection(path))
+    pool.release(conn)
+    pool.release(conn)
+    thread = threading.Thread(target=lambda: print(pool.connection(path) is not None))
+    thread.start()
+    thread.join()
+    print(pool.stats())
+    pool.close_all()
+    print(pool.stats())
+
+if __name__ == "__main__":
+    # test_ConnectionPool()
+    pass
@@ -1,8 +1,12 @@
 import os
 import sys
 import json
-import math
 import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from pathlib import Path
@@ -10,30 +14,53 @@ from pathlib import Path
 script_dir = os.path.dirname(os.path.abspath(__file__))
 os.chdir(script_dir)
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import explorer.grid as grid
+from explorer.bloom import BloomFilter
+from explorer.cache import CellCache
+from explorer.connection import ConnectionPool
+from explorer.grid import InvalidCoordinateError
+import explorer.query as query
 import explorer.risk as risk
+import explorer.sources as sources
 
 
-DEGREE_DIFFERENCE = 0.0001
-TRACKING_JSON_PATH = r".\data\tracking.json"
+DEGREE_DIFFERENCE = grid.TRAFFIC_ACCIDENT_DIFFERENCE
+TRACKING_JSON_PATH = "./data/tracking.json"
+# SQLite allows 999 bound variables per statement
+CELL_CHUNK_SIZE = 900
+# The number of csv rows the traffic accident update reads at once
+CAR_ACCIDENT_CHUNK_SIZE = int(os.getenv("CAR_ACCIDENT_CHUNK_SIZE", "50000"))
+# Set 'USE_TRAFFIC_ACCIDENT_INDEX=1' to resolve routes with the in-memory index
+USE_TRAFFIC_ACCIDENT_INDEX = os.getenv("USE_TRAFFIC_ACCIDENT_INDEX", "0") == "1"
+# Set 'USE_CELL_FILTER=0' to look up every cell without the Bloom filters
+USE_CELL_FILTER = os.getenv("USE_CELL_FILTER", "1") == "1"
+# The earthquake csv files are checked for changes at most once in this
+# interval on earthquake range lookups
+EARTHQUAKE_STORE_CHECK_INTERVAL = float(os.getenv("EARTHQUAKE_STORE_CHECK_INTERVAL", "1")) # seconds
+# The connections of every SQLController, one per thread
+CONNECTION_POOL = ConnectionPool()
+
+def close_connections():
+    """This method is used to close the database connections of the current
+        thread, e.g. before a thread of a worker finishes."""
+
+    CONNECTION_POOL.close()
+
+def close_all_connections():
+    """This method is used to close the database connections of every thread
+        when a worker process exits."""
+
+    CONNECTION_POOL.close_all()
 
 def rounding(degree, difference=DEGREE_DIFFERENCE):
     """This method is used to determine rounded values of degrees of latitudes
         or longitudes based on degrees of latitude difference and longitude
         difference, respectively. By default, both latitude and longitude are
-        calculated by a constant 'DEGREE_DIFFERENCE' in a value of 0.0001."""
+        calculated by a constant 'DEGREE_DIFFERENCE' in a value of 0.0001.
 
-    power = math.log10(difference)
-    if power > 0:
-        return round(float(degree) / difference) * difference
-    else:
-        decimal_place = math.ceil(abs(power))
-        return round(round(float(degree) / difference) * difference, decimal_place)
+    Spatial keys should use 'grid.cell' instead, which compares as integers."""
 
-class InvalidCoordinateError(Exception):
-    def __init__(self, message="""Invalid coordinate. Must provide either a single
-                                 iterable or separate latitude and longitude values."""):
-        self.message = message
-        super().__init__(self.message)
+    return grid.decode(grid.encode(degree, difference), difference)
 
 class Coordinate:
     def __init__(self, *coordinate) -> None:
@@ -62,8 +89,10 @@ class Coordinate:
             message = "Invalid latitude value. Must between -180 and 180 degrees."
             raise InvalidCoordinateError(message)
 
-        self.latitude_grid = rounding(self.latitude)
-        self.longitude_grid = rounding(self.longitude)
+        self.cell = grid.cell(self.latitude, self.longitude)
+        self.earthquake_cell = grid.cell(self.latitude, self.longitude,
+                                         grid.EARTHQUAKE_DIFFERENCE)
+        self.latitude_grid, self.longitude_grid = grid.cell_coordinate(self.cell)
         self._traffic_accident = None
         self._earthquake = None
 
@@ -81,8 +110,7 @@ class Coordinate:
 
 class TrafficAccidentData():
     def __init__(self, latitude, longitude):
-        controller = TrafficAccidentSQLController()
-        self.data = controller.select_from_coordinate(latitude, longitude)
+        self.data = traffic_accident_rows([grid.cell(latitude, longitude)])
         self.id = None
         self.number = None
         self.total_fatality = None
@@ -101,10 +129,9 @@ class TrafficAccidentData():
 
 class EarthquakeData():
     def __init__(self, latitude, longitude):
-        self.latitude = rounding(latitude, difference=0.01)
-        self.longitude = rounding(longitude, difference=0.01)
-        controller = EarthquakeSQLController()
-        self.data = controller.select_from_coordinate(self.latitude, self.longitude)
+        self.cell = grid.cell(latitude, longitude, grid.EARTHQUAKE_DIFFERENCE)
+        self.latitude, self.longitude = grid.cell_coordinate(self.cell, grid.EARTHQUAKE_DIFFERENCE)
+        self.data = earthquake_rows([self.cell])
 
         self.id = []
         self.date = []
@@ -139,7 +166,101 @@ def strip_area_2(string):
         string = string[:3]
     return string
 
+def parse_unique(values, function):
+    """This method is used to apply a vectorized function to the distinct
+        values of a column only, and to spread the results back to every
+        row.
+
+    :type values: pandas.Series
+
+    :param function: It takes a pandas.Series of the distinct values and
+        returns a pandas.Series or pandas.DataFrame of the same length.
+    :type function: function
+
+    :rtype: pandas.Series or pandas.DataFrame with the index of 'values'"""
+
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    results = function(pd.Series(uniques)).take(codes)
+    results.index = values.index
+    return results
+
+def parse_times(values):
+    """This method is used to convert times like 93015 to "09:30:15".
+
+    :type values: pandas.Series of int
+
+    :raises ValueError: if a value is not a valid time"""
+
+    strings = values.astype(str).str.zfill(6)
+    # Only validates, formatting is much faster with string slices
+    pd.to_datetime(strings, format="%H%M%S")
+    return strings.str[:2] + ":" + strings.str[2:4] + ":" + strings.str[4:]
+
+def normalize_intensities(values):
+    """This method is used to convert intensities of the csv files to the
+        keys of 'risk.SEISMIC_INTENSITY_SCALE', e.g. "4" to "4級" and "5 弱"
+        to "5弱".
+
+    :type values: pandas.Series of str"""
+
+    return values.str.replace(" ", "", regex=False).where(values.str.len() != 1, values + "級")
+
+def strip_area_2s(strings):
+    """This method is the vectorized version of 'strip_area_2'.
+
+    :type strings: pandas.Series of str
+
+    :rtype: pandas.Series of str"""
+
+    is_suffix_2 = strings.str[2].isin(list("鄉鎮市區"))
+    is_suffix_1 = strings.str[1].isin(list("鄉鎮市區"))
+    return strings.where(~is_suffix_2, strings.str[:3]).where(is_suffix_2 | ~is_suffix_1, strings.str[:2])
+
+class AccidentKeys:
+    """This class is used to remember the accidents read so far by
+        'CarAccident.chunks'. Only a 64 bit hash of the key of each accident
+        is kept, i.e. 8 bytes per accident."""
+
+    def __init__(self):
+        self._hashes = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, keys):
+        """This method is used to add the keys of a chunk, which must be
+            distinct.
+
+        :type keys: pandas.DataFrame
+
+        :return: Whether each key was not added before.
+        :rtype: numpy.ndarray of bool"""
+
+        hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy(dtype=np.uint64)
+        if not len(self._hashes):
+            is_new = np.ones(len(hashes), dtype=bool)
+        else:
+            positions = np.minimum(np.searchsorted(self._hashes, hashes), len(self._hashes) - 1)
+            is_new = self._hashes[positions] != hashes
+        # The new hashes are distinct, so they are only merged in order
+        new_hashes = np.sort(hashes[is_new])
+        self._hashes = np.insert(self._hashes, np.searchsorted(self._hashes, new_hashes), new_hashes)
+        return is_new
+
 class CarAccident:
+    DTYPES = {
+        "發生日期": str,
+        "發生時間": str,
+        "經度": float,
+        "緯度": float,
+        "死亡受傷人數": str,
+        "發生地點": str,
+        "事故類型": str
+    }
+    KEY = ["發生日期", "發生時間", "緯度", "經度"]
+    # The columns '_get_data' uses
+    COLUMNS = KEY + ["死亡受傷人數", "發生地點", "事故類型及型態大類別名稱"]
+
     def __init__(self, year, month=None, rank=2):
         """This class is used to get data from car accident csv files.
 
@@ -174,21 +295,53 @@ class CarAccident:
             raise InvalidRangeError(message)
         check_if_month_is_valid(self._month)
 
+    @classmethod
+    def chunks(cls, year, month=None, rank=2, chunksize=CAR_ACCIDENT_CHUNK_SIZE):
+        """This method is used to read the csv files in chunks of at most
+            'chunksize' rows instead of all at once, so that the memory used
+            depends on the chunk size and not on the number of months. Each
+            chunk is a 'CarAccident' of its own, which only reads 'COLUMNS'.
+            The rows of an accident which were read in an earlier chunk are
+            dropped, as 'CarAccident(year, month, rank)' drops them.
+
+        :rtype: generator of CarAccident"""
+
+        accident = cls.__new__(cls)
+        accident._year = year
+        accident._month = month
+        accident._rank = rank
+        accident._is_arg_valid()
+        seen = AccidentKeys()
+        for path in accident._paths():
+            for df in sources.read_csv_chunks(path, chunksize, footer=2, dtype=cls.DTYPES,
+                                              usecols=cls.COLUMNS):
+                chunk = cls.__new__(cls)
+                chunk._year = year
+                chunk._month = month
+                chunk._rank = rank
+                chunk._df = df
+                chunk._get_data(seen)
+                if len(chunk.data):
+                    yield chunk
+
+    def _paths(self):
+        """This method is used to get the csv files of the arguments."""
+
+        if self._rank == 1 or self._rank == '1' or self._rank == "A1" or self._rank == "a1":
+            return [f"./data/accidents/{self._year}/{self._year}年度A1交通事故資料.csv"]
+        elif self._rank == 2 or self._rank == '2' or self._rank == "A2" or self._rank == "a2":
+            months = [self._month] if self._month else range(1, 13)
+            return [f"./data/accidents/{self._year}/{self._year}年度A2交通事故資料_{m}.csv" for m in months]
+        else:
+            message = "Invalid rank. Must be either 1, '1', 'A1', 'a1', or 2, '2', 'A2', 'a2'."
+            raise InvalidRangeError(message)
+
     def _read_csv_file(self):
         """This method is used to read and get data from the csv files."""
 
-        dtype_mapping = {
-            "發生日期": str,
-            "發生時間": str,
-            "經度": float,
-            "緯度": float,
-            "死亡受傷人數": str,
-            "發生地點": str,
-            "事故類型": str
-        }
+        paths = self._paths()
         if self._rank == 1 or self._rank == '1' or self._rank == "A1" or self._rank == "a1":
-            path = f"./data/accidents/{self._year}/{self._year}年度A1交通事故資料.csv"
-            self._df = pd.read_csv(path)
+            self._df = sources.read_csv(paths[0])
             self._df = self._df[:-2]
             # if self._month:
             #     self._df['發生日期'] = self._df['發生日期'].astype(int)
@@ -198,144 +351,114 @@ class CarAccident:
             #         self._df = self._df[self._df['發生日期'].astype(str).str[4:6] == f"0{self._month}"]
             #     self._df['發生日期'] = self._df['發生日期'].astype(float)
             #     self._df = self._df.reset_index(drop=True)
-        elif self._rank == 2 or self._rank == '2' or self._rank == "A2" or self._rank == "a2":
-            if not self._month:
-                for m in range(1, 13):
-                    path = f"./data/accidents/{self._year}/{self._year}年度A2交通事故資料_{m}.csv"
-                    monthly_data = pd.read_csv(path, dtype=dtype_mapping, low_memory=False)
-                    monthly_data = monthly_data[:-2]
-                    self._df = pd.concat([self._df, monthly_data], ignore_index=True)
-            else:
-                path = f"./data/accidents/{self._year}/{self._year}年度A2交通事故資料_{self._month}.csv"
-                self._df = pd.read_csv(path, dtype=dtype_mapping, low_memory=False)
-                self._df = self._df[:-2]
         else:
-            message = "Invalid rank. Must be either 1, '1', 'A1', 'a1', or 2, '2', 'A2', 'a2'."
-            raise InvalidRangeError(message)
+            # Concatenated once, a concatenation per month copies the
+            # earlier months again every time
+            monthly_data = [sources.read_csv(path, dtype=self.DTYPES, low_memory=False)[:-2]
+                            for path in paths]
+            self._df = pd.concat(monthly_data, ignore_index=True)
 
-    def _get_data(self):
+    def _get_data(self, seen=None):
         """This method is used to take the data of interest"""
 
-        self._dates = [datetime.strptime(str(int(d)), "%Y%m%d").strftime("%Y-%m-%d") for d in self._df["發生日期"]]
-        self._times = [datetime.strptime(str(int(t)).zfill(6), "%H%M%S").strftime("%H:%M:%S") for t in self._df["發生時間"]]
-        self._latitudes = self._df["緯度"]
-        self._longitudes = self._df["經度"]
-        self._casualties = self._df["死亡受傷人數"]
-        self._fatalities = [int(c[2]) for c in self._casualties]
-        self._injuries = [int(c[-1]) for c in self._casualties]
-        self._location = self._df["發生地點"]
-        self._area_1 = [loc[:3] for loc in self._location]
-        self._area_2 = [loc[3:7] for loc in self._location]
-        # Check if the third character of the string is not one of "鄉", "鎮", "市", or "區"
-        for i in range(len(self._area_2)):
-            self._area_2[i] =  strip_area_2(self._area_2[i])
-        self._includes_pedestrian = self._df["事故類型及型態大類別名稱"].str.contains('人')
-
-        self._reorganize_data()
-
-    def _reorganize_data(self):
-        """This method is used to take out the duplicated data"""
-
-        check = 0
-        longitude_check = 0
-        latitude_check = 0
-        self._data = []
-        for i in range(len(self._dates)):
-            if self._times[i] == check:
-                if (self._longitudes[i] == longitude_check) and (self._latitudes[i] == latitude_check):
-                    continue
-                else:
-                    longitude_check = self._longitudes[i]
-                    latitude_check = self._latitudes[i]
-            else:
-                check = self._times[i]
-                self._data.append([
-                    self._dates[i],
-                    self._times[i],
-                    self._latitudes[i],
-                    self._longitudes[i],
-                    self._fatalities[i],
-                    self._injuries[i],
-                    self._area_1[i],
-                    self._area_2[i],
-                    self._includes_pedestrian[i]
-                ])
-        self.data = pd.DataFrame(self._data, columns=[
-            "date",
-            "time",
-            "latitude",
-            "longitude",
-            "fatality",
-            "injury",
-            "area_1",
-            "area_2",
-            "includes_pedestrian"
-        ])
-        self._dates = self.data.iloc[:, 0]
-        self._times = self.data.iloc[:, 1]
-        self._latitudes = self.data.iloc[:, 2]
-        self._longitudes = self.data.iloc[:, 3]
-        self._fatalities = self.data.iloc[:, 4]
-        self._injuries = self.data.iloc[:, 5]
-        self._area_1s = self.data.iloc[:, 6]
-        self._area_2s = self.data.iloc[:, 7]
-        self._includes_pedestrian = self.data.iloc[:, 8]
-
-    def date(self, id=None):
+        self._reorganize_data(seen)
+        # Dates, times, locations and casualties repeat a lot, so each
+        # distinct value is parsed once
+        dates = parse_unique(self._df["發生日期"],
+                             lambda values: pd.to_datetime(values.astype(str), format="%Y%m%d")
+                                              .dt.strftime("%Y-%m-%d"))
+        times = parse_unique(self._df["發生時間"], parse_times)
+        # e.g. "死亡0;受傷2"
+        casualties = parse_unique(self._df["死亡受傷人數"],
+                                  lambda values: values.str.extract(r"^\D*(\d+)\D+(\d+)\s*$").astype(np.int64))
+        areas = parse_unique(self._df["發生地點"].str[:7],
+                             lambda values: pd.DataFrame({
+                                 "area_1": values.str[:3],
+                                 # Check if the third character of the string is not one of "鄉", "鎮", "市", or "區"
+                                 "area_2": strip_area_2s(values.str[3:7]),
+                             }))
+        self.data = pd.DataFrame({
+            "date": dates,
+            "time": times,
+            "latitude": self._df["緯度"].astype(np.float64),
+            "longitude": self._df["經度"].astype(np.float64),
+            "fatality": casualties[0],
+            "injury": casualties[1],
+            "area_1": areas["area_1"],
+            "area_2": areas["area_2"],
+            "includes_pedestrian": parse_unique(self._df["事故類型及型態大類別名稱"],
+                                                lambda values: values.str.contains("人")),
+        })
+
+    def _reorganize_data(self, seen=None):
+        """This method is used to take out the duplicated data
+
+        Each party of an accident has a row of its own, so the rows of the
+        same date, time and coordinate are one accident.
+
+        :param seen: The accidents of the earlier chunks, see 'chunks'.
+        :type seen: AccidentKeys"""
+
+        self._df = self._df.assign(**{
+            "發生日期": pd.to_numeric(self._df["發生日期"]).astype(np.int64),
+            "發生時間": pd.to_numeric(self._df["發生時間"]).astype(np.int64),
+        })
+        self._df = self._df.drop_duplicates(self.KEY, keep="first")
+        if seen is not None:
+            self._df = self._df[seen.add(self._df[self.KEY])]
+        self._df = self._df.reset_index(drop=True)
+
+    def _column(self, name, id=None):
         if id is not None:
-            return self._dates[id]
+            return self.data[name].iat[id]
         else:
-            return self._dates
+            return self.data[name]
+
+    def date(self, id=None):
+        return self._column("date", id)
 
     def time(self, id=None):
-        if id is not None:
-            return self._times[id]
-        else:
-            return self._times
+        return self._column("time", id)
 
     def latitude(self, id=None):
-        if id is not None:
-            return self._latitudes[id]
-        else:
-            return self._latitudes
+        return self._column("latitude", id)
 
     def longitude(self, id=None):
-        if id is not None:
-            return self._longitudes[id]
-        else:
-            return self._longitudes
+        return self._column("longitude", id)
 
     def fatality(self, id=None):
         if id is not None:
-            return int(self._fatalities[id])
+            return int(self._column("fatality", id))
         else:
-            return self._fatalities
+            return self._column("fatality")
 
     def injury(self, id=None):
         if id is not None:
-            return int(self._injuries[id])
+            return int(self._column("injury", id))
         else:
-            return self._injuries
+            return self._column("injury")
 
     def area_1(self, id=None):
-        if id is not None:
-            return self._area_1s[id]
-        else:
-            return self._area_1s
+        return self._column("area_1", id)
 
     def area_2(self, id=None):
-        if id is not None:
-            return self._area_2s[id]
-        else:
-            return self._area_2s
+        return self._column("area_2", id)
 
     def includes_pedestrian(self, id=None):
-        if id is not None:
-            return self._includes_pedestrian[id]
-        else:
-            return self._includes_pedestrian
+        return self._column("includes_pedestrian", id)
 
 class Earthquake:
+    DTYPES = {
+        "Date": str,
+        "Time": str,
+        "北緯": float,
+        "東經": float,
+        "芮氏規模": float,
+        "深度": float,
+        "城市": str,
+        "震度": str
+    }
+
     def __init__(self, year, starting_month=None, ending_month=None):
         self._year = year
         self._starting_momth = starting_month
@@ -375,51 +498,48 @@ class Earthquake:
             message = "Invalid range. Parameter 'starting_month' must be equal to or smaller than 'ending_month'."
             raise InvalidRangeError(message)
 
+    @staticmethod
+    def csv_path(year):
+        return f"./data/earthquakes/earthquake_{year}年.csv"
+
+    @classmethod
+    def range(cls, start_date, end_date, bbox=None):
+        """This method is used to get the earthquakes between two dates of
+            any years, see 'EarthquakeStore.range'.
+
+        :rtype: EarthquakeRange"""
+
+        return earthquake_store().range(start_date, end_date, bbox)
+
     def _read_csv_file(self):
-        path = f".\data\earthquakes\earthquake_{self._year}年.csv"
-        dtype_mapping = {
-            "Date": str,
-            "Time": str,
-            "北緯": float,
-            "東經": float,
-            "芮氏規模": float,
-            "深度": float,
-            "城市": str,
-            "震度": str
-        }
-        self._df = pd.read_csv(path, engine='python', encoding="big5", dtype=dtype_mapping)
+        self._df = sources.read_csv(self.csv_path(self._year), encoding="big5", dtype=self.DTYPES)
 
     def _get_data(self):
-        self._dates = [datetime.strptime(d, "%Y-%m-%d") for d in self._df["Date"]]
-        self.starting_index = self.ending_index = 0
-        starting_flag = True
-        for date in self._dates:
-            if starting_flag:
-                if date.month == self._starting_momth:
-                    starting_flag = False
-                else:
-                    self.starting_index += 1
-            if date.month == self._ending_month + 1:
-                break
-            self.ending_index += 1
+        """This method is used to take the data of the months in range with
+            a binary search over the months of the dates. The csv files are
+            in ascending order of months."""
+
+        dates = pd.to_datetime(self._df["Date"], format="%Y-%m-%d")
+        months = dates.dt.month.to_numpy()
+        if np.any(np.diff(months) < 0):
+            order = np.argsort(months, kind="stable")
+            self._df = self._df.iloc[order].reset_index(drop=True)
+            dates = dates.iloc[order].reset_index(drop=True)
+            months = months[order]
+        self.starting_index = int(np.searchsorted(months, self._starting_momth, side="left"))
+        self.ending_index = int(np.searchsorted(months, self._ending_month, side="right"))
         self.size = self.ending_index - self.starting_index
 
-        self._dates = self._df["Date"][self.starting_index: self.ending_index]
-        self._times = self._df["Time"][self.starting_index: self.ending_index]
-        for i in range(self.starting_index, self.ending_index):
-            self._dates[i] = datetime.strptime(self._dates[i], "%Y-%m-%d").date()
-            self._times[i] = datetime.strptime(self._times[i], "%H:%M:%S").time()
-        self._latitudes = self._df["北緯"][self.starting_index: self.ending_index]
-        self._longitudes = self._df["東經"][self.starting_index: self.ending_index]
-        self._magnitudes = self._df["芮氏規模"][self.starting_index: self.ending_index]
-        self._depths = self._df["深度"][self.starting_index: self.ending_index]
-        self._areas = self._df["城市"][self.starting_index: self.ending_index]
-        self._intensities = self._df["震度"][self.starting_index: self.ending_index]
-        for i in range(self.starting_index, self.ending_index):
-            if len(self._intensities[i]) != 1:
-                self._intensities[i] = self._intensities[i].replace(" ", "")
-            else:
-                self._intensities[i] += "級"
+        window = slice(self.starting_index, self.ending_index)
+        self._dates = dates[window].dt.date
+        self._times = parse_unique(self._df["Time"][window],
+                                   lambda values: pd.to_datetime(values, format="%H:%M:%S").dt.time)
+        self._latitudes = self._df["北緯"][window]
+        self._longitudes = self._df["東經"][window]
+        self._magnitudes = self._df["芮氏規模"][window]
+        self._depths = self._df["深度"][window]
+        self._areas = self._df["城市"][window]
+        self._intensities = parse_unique(self._df["震度"][window], normalize_intensities)
 
     def date(self, id=None):
         if id is None:
@@ -469,6 +589,212 @@ class Earthquake:
         else:
             return self._intensities[id]
 
+class EarthquakeRange:
+    """This class is used to access the earthquakes found by
+        'EarthquakeStore.range'. A column is only sliced and converted when
+        it is used for the first time, and ids are positions in the range.
+
+    :param frame: The frame of the store, which is never modified.
+    :type frame: pandas.DataFrame
+
+    :param mask: The rows of the slice inside the bounding box, if any.
+    :type mask: numpy.ndarray of bool
+    """
+
+    def __init__(self, frame, start, end, mask=None):
+        self._frame = frame
+        self._slice = slice(start, end)
+        self._mask = mask
+        self._columns = {}
+        self.size = int(mask.sum()) if mask is not None else end - start
+
+    def __len__(self):
+        return self.size
+
+    def _column(self, name, id=None):
+        if name not in self._columns:
+            if name in ("date", "time"):
+                timestamps = pd.DatetimeIndex(self._column("timestamp").astype("datetime64[ns]"))
+                values = timestamps.date if name == "date" else timestamps.time
+            else:
+                values = self._frame[name].to_numpy()[self._slice]
+                if self._mask is not None:
+                    values = values[self._mask]
+            self._columns[name] = values
+        if id is not None:
+            return self._columns[name][id]
+        else:
+            return self._columns[name]
+
+    def date(self, id=None):
+        return self._column("date", id)
+
+    def time(self, id=None):
+        return self._column("time", id)
+
+    def latitude(self, id=None):
+        return self._column("latitude", id)
+
+    def longitude(self, id=None):
+        return self._column("longitude", id)
+
+    def magnitude(self, id=None):
+        return self._column("magnitude", id)
+
+    def depth(self, id=None):
+        return self._column("depth", id)
+
+    def area(self, id=None):
+        return self._column("area", id)
+
+    def intensity(self, id=None):
+        return self._column("intensity", id)
+
+    def to_frame(self):
+        return pd.DataFrame({name: self._column(name) for name in EarthquakeStore.COLUMNS[1:]},
+                            index=pd.DatetimeIndex(self._column("timestamp").astype("datetime64[ns]")))
+
+class EarthquakeStore:
+    """This class is used to keep the earthquakes of every year in one frame
+        sorted by time, so that the earthquakes between two dates are found
+        with a binary search instead of parsing the csv file of each year.
+
+    The frame is saved in the cache directory of 'explorer.sources', when
+    the cache is on, with the size and modification time of the csv file of
+    each year. 'refresh' only
+    parses the years whose csv file is new or has changed, e.g. the current
+    year when new months arrive, and appends them. 'range' refreshes at
+    most once every 'check_interval' seconds, so long-lived workers see the
+    years added by update runs of other processes.
+    """
+
+    # Times are int64 nanoseconds since the epoch, local time as in the csv
+    # files
+    COLUMNS = ("timestamp", "latitude", "longitude", "magnitude", "depth", "area", "intensity")
+
+    def __init__(self, name="earthquake_store", check_interval=EARTHQUAKE_STORE_CHECK_INTERVAL):
+        self.path = sources.frame_path(name)
+        self.check_interval = check_interval
+        self.frame = None
+        self.years = {}
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            if not sources.USE_SOURCE_CACHE:
+                raise OSError("The source cache is off")
+            with open(f"{self.path}.json") as file:
+                self.years = {int(year): status for year, status in json.load(file)["years"].items()}
+            self.frame = sources.load_frame(self.path)
+        except (OSError, ValueError, KeyError):
+            self.years = {}
+            self.frame = pd.DataFrame({name: pd.Series(dtype=object if name in ("area", "intensity") else
+                                                       np.int64 if name == "timestamp" else np.float64)
+                                       for name in self.COLUMNS})
+
+    def _save(self):
+        if not sources.USE_SOURCE_CACHE:
+            return
+        sources.save_frame(self.frame, self.path)
+        temporary_path = f"{self.path}.json.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"years": self.years}, file)
+        os.replace(temporary_path, f"{self.path}.json")
+
+    @staticmethod
+    def _year_frame(year):
+        df = sources.read_csv(Earthquake.csv_path(year), encoding="big5", dtype=Earthquake.DTYPES)
+        timestamps = parse_unique(df["Date"] + " " + df["Time"],
+                                  lambda values: pd.to_datetime(values, format="%Y-%m-%d %H:%M:%S"))
+        return pd.DataFrame({
+            "timestamp": timestamps.to_numpy(dtype="datetime64[ns]").view(np.int64),
+            "latitude": df["北緯"].astype(np.float64),
+            "longitude": df["東經"].astype(np.float64),
+            "magnitude": df["芮氏規模"].astype(np.float64),
+            "depth": df["深度"].astype(np.float64),
+            "area": df["城市"].astype(object),
+            "intensity": parse_unique(df["震度"], normalize_intensities).astype(object),
+        })
+
+    def refresh(self):
+        """This method is used to parse the csv files which are new or have
+            changed since the last refresh.
+
+        :return: The number of rows parsed.
+        :rtype: int"""
+
+        with self._lock:
+            if self.frame is None:
+                self._load()
+            self._checked_at = time.monotonic()
+            with open(TRACKING_JSON_PATH) as file:
+                starting_year = json.load(file)["csv"]["earthquake"]["starting_year"]
+            changed = {}
+            for year in range(starting_year, datetime.now().year + 1):
+                path = Earthquake.csv_path(year)
+                if not os.path.exists(path):
+                    continue
+                status = os.stat(path)
+                if self.years.get(year) != [status.st_size, status.st_mtime_ns]:
+                    changed[year] = [status.st_size, status.st_mtime_ns]
+            if not changed:
+                return 0
+
+            frames = [self._year_frame(year) for year in sorted(changed)]
+            years = self.frame["timestamp"].to_numpy().astype("datetime64[ns]").astype("datetime64[Y]")
+            kept = self.frame[~np.isin(years.astype(np.int64) + 1970, list(changed))]
+            frame = pd.concat([kept] + frames, ignore_index=True)
+            if not frame["timestamp"].is_monotonic_increasing:
+                # Rows of the same time keep the order of the csv files
+                order = np.argsort(frame["timestamp"].to_numpy(), kind="stable")
+                frame = frame.iloc[order].reset_index(drop=True)
+            self.frame = frame
+            self.years.update(changed)
+            self._save()
+            return sum(len(frame) for frame in frames)
+
+    def range(self, start_date, end_date, bbox=None):
+        """This method is used to get the earthquakes between two dates.
+
+        :param start_date: The first date, e.g. "1999-09-21".
+        :type start_date: str, datetime.date or datetime.datetime
+
+        :param end_date: The last date, which is included.
+        :type end_date: str, datetime.date or datetime.datetime
+
+        :param bbox: The south, west, north and east bounds of the epicenters.
+        :type bbox: tuple of 4 float
+
+        :rtype: EarthquakeRange"""
+
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+        frame = self.frame
+        timestamps = frame["timestamp"].to_numpy()
+        start = pd.Timestamp(start_date).normalize().value
+        end = (pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)).value
+        start, end = np.searchsorted(timestamps, [start, end], side="left")
+        mask = None
+        if bbox is not None:
+            south, west, north, east = bbox
+            latitudes = frame["latitude"].to_numpy()[start:end]
+            longitudes = frame["longitude"].to_numpy()[start:end]
+            mask = ((latitudes >= south) & (latitudes <= north) &
+                    (longitudes >= west) & (longitudes <= east))
+        return EarthquakeRange(frame, int(start), int(end), mask)
+
+_earthquake_store = None
+
+def earthquake_store():
+    """This method is used to get the earthquake store of the current
+        process."""
+
+    global _earthquake_store
+    if _earthquake_store is None:
+        _earthquake_store = EarthquakeStore()
+    return _earthquake_store
+
 class Attraction:
     def __init__(self, index=1):
         self._index = index
@@ -490,7 +816,7 @@ class Attraction:
         }
         if self._index == 1 or self._index == 2 or self._index == 3:
             path = f"./data/hotspots/Taiwan_attractions_{self._index}.csv"
-            self._df = pd.read_csv(path, dtype=dtype_mapping, low_memory=False)
+            self._df = sources.read_csv(path, dtype=dtype_mapping, low_memory=False)
         else:
             message = "Invalid index. Must be either 1, 2, or 3."
             raise InvalidRangeError(message)
@@ -643,7 +969,7 @@ class Restaurant:
             "image": str
         }
         path = "./data/restaurants/Taiwan_food.csv"
-        self._df = pd.read_csv(path, dtype=dtype_mapping, low_memory=False)
+        self._df = sources.read_csv(path, dtype=dtype_mapping, low_memory=False)
 
     def _get_data(self):
         """This method is used to take the data of interest"""
@@ -793,47 +1119,79 @@ class SQLController:
     # PATH = r"..\.\db.sqlite3"
     BASE_DIR = Path(__file__).resolve().parent.parent
     PATH = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, "db.sqlite3"))
+    # The typed columns of the table. Only these names may appear in a
+    # statement, see 'explorer.query'
+    COLUMNS = {}
+
     def __init__(self, table_name):
         self.table_name = table_name
-        self.conn = sqlite3.connect(SQLController.PATH)
+        self.conn = CONNECTION_POOL.connection(SQLController.PATH)
         self.cursor = self.conn.cursor()
 
     def close(self):
-        self.conn.close()
+        # The connection stays open for the next controller of the thread
+        self.cursor.close()
+        CONNECTION_POOL.release(self.conn)
+
+    def data_version(self):
+        """This method is used to get the version of the data in the database.
+            The version is stored in 'PRAGMA user_version' and increased by
+            every update run, so in-memory copies of the data know when to
+            reload."""
+
+        self.cursor.execute("PRAGMA user_version")
+        return self.cursor.fetchone()[0]
+
+    def bump_data_version(self):
+        version = self.data_version() + 1
+        self.cursor.execute(f"PRAGMA user_version = {int(version)}")
+        self.conn.commit()
+        return version
+
+    def _columns(self, names):
+        return query.check_columns(self.table_name, self.COLUMNS, names)
 
     def select(self, id=None, column=None):
+        columns = self._columns(column) if column else ("*",)
         if id:
-            if column:
-                sql = f"SELECT {column} FROM {self.table_name} WHERE id={id}"
-                self.cursor.execute(sql)
-                return self.cursor.fetchone()[0]
-            else:
-                sql = f"SELECT * FROM {self.table_name} WHERE id={id}"
-                self.cursor.execute(sql)
-                return self.cursor.fetchone()
-        else:
-            if column:
-                sql = f"SELECT {column} FROM {self.table_name}"
-            else:
-                sql = f"SELECT * FROM {self.table_name}"
-        self.cursor.execute(sql)
+            self.cursor.execute(query.select(self.table_name, columns, where=("id",)), (int(id),))
+            data = self.cursor.fetchone()
+            if column and len(columns) == 1:
+                return data[0]
+            return data
+        self.cursor.execute(query.select(self.table_name, columns))
         return self.cursor.fetchall()
 
     def select_from_coordinate(self, latitude, longitude):
-        sql = f"""SELECT * FROM {self.table_name}
-                WHERE latitude={latitude} AND longitude={longitude}"""
-        self.cursor.execute(sql)
+        sql = query.select(self.table_name, where=("latitude", "longitude"))
+        self.cursor.execute(sql, (float(latitude), float(longitude)))
         data = self.cursor.fetchall()
         if data:
             return data
         else:
             return None
 
+    def select_from_cells(self, cells):
+        """This method is used to get data of a set of grid cells at once. The
+            cells are resolved in chunks with an 'IN' clause on the integer
+            'cell' column, so a whole route costs a few queries instead of
+            one query per coordinate.
+
+        :param cells: keys of grid cells, see 'grid.cell'
+        :type cells: iterable of int"""
+
+        data = []
+        cells = [int(cell) for cell in cells]
+        for index in range(0, len(cells), CELL_CHUNK_SIZE):
+            chunk = query.pad(cells[index: index + CELL_CHUNK_SIZE])
+            self.cursor.execute(query.select_in(self.table_name, ("*",), "cell", len(chunk)), chunk)
+            data += self.cursor.fetchall()
+        return data
+
     def select_by_order(self, ordered_column, is_ascending=True):
-        sql = f"SELECT * FROM {self.table_name} ORDER BY {ordered_column}"
-        if not is_ascending:
-            sql += " DESC"
-        self.cursor.execute(sql)
+        ordered_column, = self._columns([ordered_column])
+        self.cursor.execute(query.select(self.table_name, order_by=ordered_column,
+                                         descending=not is_ascending))
         data = self.cursor.fetchall()
         if data:
             return data
@@ -847,35 +1205,100 @@ class SQLController:
         :type *columns: tuple
 
         e.g. *columns = ("area_1", "new taipei city"), ("area_2", "yonghe")
+
+        Column names must be in 'COLUMNS' and values are converted to the
+        types of their columns, so user input is never part of the SQL.
         """
 
-        sqls = []
-        if type(columns[0]) == list:
+        if columns and type(columns[0]) == list:
             columns = columns[0]
-        for column in columns:
-            if type(column[1]) == str:
-                sqls.append(f"{column[0]} = '{column[1]}'")
-            else:
-                sqls.append(f"{column[0]} = {column[1]}")
-        sql = " AND ".join(sqls)
-        sql = f"SELECT * FROM {self.table_name} WHERE " + sql
+        names = self._columns([column[0] for column in columns])
+        values = [query.check_value(self.table_name, self.COLUMNS, name, column[1])
+                  for name, column in zip(names, columns)]
 
-        self.cursor.execute(sql)
+        self.cursor.execute(query.select(self.table_name, where=names), values)
         data = self.cursor.fetchall()
         if data:
             return data
         else:
             return None
 
+def accident_counts(fatalities, injuries, includes_pedestrian):
+    """This method is used to get the values of 'COUNT_COLUMNS' of each
+        accident, which are added up per grid cell and per administrative
+        area by the bulk ingest.
+
+    :rtype: pandas.DataFrame"""
+
+    fatalities = np.asarray(fatalities, dtype=np.int64)
+    injuries = np.asarray(injuries, dtype=np.int64)
+    pedestrian = pd.Series(includes_pedestrian).astype("boolean").fillna(False).to_numpy(dtype=bool)
+    return pd.DataFrame({
+        "number": np.ones(len(fatalities), dtype=np.int64),
+        "total_fatality": fatalities,
+        "total_injury": injuries,
+        "pedestrian_fatality": np.where(pedestrian, fatalities, 0),
+        "pedestrian_injury": np.where(pedestrian, injuries, 0),
+    })
+
+class RunningCounts:
+    """This class is used to add up the results of 'aggregate' of many
+        chunks, e.g. while 'CarAccident.chunks' is read. The counts of new
+        chunks are kept apart until they have as many rows as the total, so
+        that the total is not rebuilt for every chunk."""
+
+    def __init__(self):
+        self._total = None
+        self._pending = []
+        self._pending_rows = 0
+
+    def add(self, counts):
+        self._pending.append(counts)
+        self._pending_rows += len(counts)
+        if self._total is None or self._pending_rows >= len(self._total):
+            self._fold()
+
+    def _fold(self):
+        frames = self._pending if self._total is None else [self._total] + self._pending
+        total = pd.concat(frames)
+        self._total = total.groupby(level=list(range(total.index.nlevels)), sort=True).sum()
+        self._pending = []
+        self._pending_rows = 0
+
+    def result(self):
+        """:return: The counts of every chunk added so far, or None if no
+            chunk was added.
+        :rtype: pandas.DataFrame"""
+
+        if self._pending:
+            self._fold()
+        return self._total
+
 class TrafficAccidentSQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "latitude": float,
+        "longitude": float,
+        "number": int,
+        "total_fatality": int,
+        "total_injury": int,
+        "pedestrian_fatality": int,
+        "pedestrian_injury": int,
+        "cell": int,
+    }
+    COUNT_COLUMNS = ("number", "total_fatality", "total_injury",
+                     "pedestrian_fatality", "pedestrian_injury")
+
     def __init__(self):
         self.table_name = "risk_traffic_accident"
         super().__init__(self.table_name)
 
     def new(self, latitude, longitude, fatality, injury, includes_pedestrian):
+        """This method is used to add one accident and commit it with a new
+            data version. Use 'bulk_new' to add many accidents."""
+
         coordinate = Coordinate(latitude, longitude)
-        self.existing_id = self.coordinate_id(coordinate.latitude_grid,
-                                              coordinate.longitude_grid)
+        self.existing_id = self.cell_id(coordinate.cell)
         total_fatality = fatality
         total_injury = injury
         if includes_pedestrian:
@@ -885,40 +1308,363 @@ class TrafficAccidentSQLController(SQLController):
             pedestrian_fatality = pedestrian_injury = 0
 
         if self.existing_id:
-            number = self.select(self.existing_id, "number") + 1
-            total_fatality += self.select(self.existing_id, "total_fatality")
-            total_injury += self.select(self.existing_id, "total_injury")
-            pedestrian_fatality += self.select(self.existing_id, "pedestrian_fatality")
-            pedestrian_injury += self.select(self.existing_id, "pedestrian_injury")
-            sql = f"""UPDATE {self.table_name}
-                        SET number = {number},
-                        total_fatality = {total_fatality},
-                        total_injury = {total_injury},
-                        pedestrian_fatality = {pedestrian_fatality},
-                        pedestrian_injury = {pedestrian_injury}
-                        WHERE id = {self.existing_id}"""
-            self.cursor.execute(sql)
+            sql = query.update_add(self.table_name, self.COUNT_COLUMNS)
+            self.cursor.execute(sql, (1, total_fatality, total_injury,
+                                      pedestrian_fatality, pedestrian_injury,
+                                      self.existing_id))
         else:
-            sql = f"""INSERT INTO {self.table_name} (latitude, longitude, number,
-                        total_fatality, total_injury, pedestrian_fatality,
-                        pedestrian_injury) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+            sql = query.insert(self.table_name, ("latitude", "longitude", "cell") + self.COUNT_COLUMNS)
             self.cursor.execute(sql, (coordinate.latitude_grid,
                                       coordinate.longitude_grid,
+                                      coordinate.cell,
                                       1, total_fatality, total_injury,
                                       pedestrian_fatality, pedestrian_injury))
-        self.conn.commit()
+            TRAFFIC_ACCIDENT_CELL_FILTER.add([coordinate.cell])
+        # Commits, and makes the other workers drop their cached rows of the
+        # cell and load the saved filters again
+        save_cell_filters(self.bump_data_version())
+
+    def bulk_new(self, latitudes, longitudes, fatalities, injuries, includes_pedestrian):
+        """This method is the bulk version of 'new'. The accidents are added
+            up per grid cell in memory and written with one upsert per cell.
+            Nothing is committed, so that a whole update run is one
+            transaction.
+
+        :return: The number of rows written.
+        :rtype: int"""
+
+        return self.bulk_add(self.aggregate(latitudes, longitudes, fatalities, injuries, includes_pedestrian))
+
+    @staticmethod
+    def aggregate(latitudes, longitudes, fatalities, injuries, includes_pedestrian):
+        """This method is used to add up the accidents per grid cell, see
+            'RunningCounts' to add up the results of several chunks.
+
+        :return: 'COUNT_COLUMNS' indexed by cell
+        :rtype: pandas.DataFrame"""
+
+        points = grid.route_array(np.column_stack([np.asarray(latitudes, dtype=np.float64),
+                                                   np.asarray(longitudes, dtype=np.float64)]))
+        grid.validate(points)
+        counts = accident_counts(fatalities, injuries, includes_pedestrian)
+        counts["cell"] = grid.cell(points[:, 0], points[:, 1])
+        return counts.groupby("cell", sort=True).sum()
+
+    def bulk_add(self, counts):
+        """This method is used to write the result of 'aggregate' with one
+            upsert per cell. Nothing is committed.
+
+        :return: The number of rows written.
+        :rtype: int"""
+
+        cells = counts.index.to_numpy(dtype=np.int64)
+        latitude_grids, longitude_grids = grid.cell_coordinate(cells)
+        rows = zip(latitude_grids.tolist(), longitude_grids.tolist(), cells.tolist(),
+                   *(counts[column].tolist() for column in self.COUNT_COLUMNS))
+        sql = query.upsert_add(self.table_name, ("latitude", "longitude", "cell"),
+                               self.COUNT_COLUMNS, conflict=("cell",))
+        self.cursor.executemany(sql, rows)
+        TRAFFIC_ACCIDENT_CELL_FILTER.add(cells)
+        return len(cells)
+
+    def cell_id(self, cell):
+        sql = query.select(self.table_name, ("id",), where=("cell",))
+        self.cursor.execute(sql, (int(cell),))
+        data = self.cursor.fetchone()
+        if data:
+            return data[0]
+        else:
+            return None
 
     def coordinate_id(self, latitude, longitude):
-        sql = f"""SELECT * FROM {self.table_name}
-                    WHERE latitude = {latitude} AND longitude = {longitude}"""
-        self.cursor.execute(sql)
+        sql = query.select(self.table_name, ("id",), where=("latitude", "longitude"))
+        self.cursor.execute(sql, (float(latitude), float(longitude)))
         data = self.cursor.fetchone()
         if data:
             return data[0]
         else:
             return None
 
+class TrafficAccidentIndex:
+    """This class is used to keep 'risk_traffic_accident' in memory as sorted
+        int64 cell keys with parallel count arrays, so the grid cells of a
+        route are resolved by a vectorized binary search instead of SQL.
+
+    The table is loaded once per worker and reloaded when the data version of
+    the database changes, i.e. after an 'UpdateTrafficAccidentData' run."""
+
+    COLUMNS = ["number", "total_fatality", "total_injury",
+               "pedestrian_fatality", "pedestrian_injury"]
+
+    def __init__(self):
+        self.version = None
+        self._keys = np.empty(0, dtype=np.int64)
+        self._counts = np.empty((0, len(self.COLUMNS)), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def reload(self):
+        """This method is used to load the table again if the data version
+            has changed since the last load."""
+
+        controller = TrafficAccidentSQLController()
+        try:
+            version = controller.data_version()
+            if version == self.version:
+                return
+            with self._lock:
+                if version == self.version:
+                    return
+                data = controller.select(column="cell, " + ", ".join(self.COLUMNS))
+                data = np.array(data, dtype=np.int64).reshape(-1, 1 + len(self.COLUMNS))
+                keys = data[:, 0]
+                counts = data[:, 1:]
+                order = np.argsort(keys, kind="stable")
+                keys, counts = keys[order], counts[order]
+                # Merge rows sharing a cell so every key appears only once
+                keys, starts = np.unique(keys, return_index=True)
+                if len(counts):
+                    counts = np.add.reduceat(counts, starts, axis=0)
+                self._keys, self._counts = keys, counts
+                self.version = version
+        finally:
+            controller.close()
+
+    def lookup(self, cells):
+        """This method is used to get the counts of each found grid cell.
+
+        :param cells: keys of grid cells, see 'grid.cell'
+        :type cells: iterable of int or numpy.ndarray
+
+        :return: the counts of the found cells in the order of 'COLUMNS'
+        :rtype: numpy.ndarray with shape (number of found cells, 5)"""
+
+        self.reload()
+        keys, counts = self._keys, self._counts
+        cells = np.unique(np.fromiter(cells, dtype=np.int64))
+        if not len(keys) or not len(cells):
+            return counts[:0]
+        positions = np.minimum(np.searchsorted(keys, cells), len(keys) - 1)
+        return counts[positions[keys[positions] == cells]]
+
+    def aggregate(self, cells):
+        """This method is used to sum up the traffic accidents of a set of
+            grid cells in the same way as '_DirectionTrafficAccidentData'
+            sums up the rows of 'traffic_accident_rows'."""
+
+        return tuple(int(total) for total in self.lookup(cells).sum(axis=0))
+
+def data_version():
+    """This method is used to get the data version of the database, see
+        'SQLController.data_version'."""
+
+    controller = TrafficAccidentSQLController()
+    try:
+        return controller.data_version()
+    finally:
+        controller.close()
+
+class CellFilter:
+    """This class is used to keep a Bloom filter of the populated grid cells
+        of a table, so that cells without records are skipped before any
+        lookup.
+
+    Update runs add the cells they write and save the filter next to the
+    database file with the new data version. Workers load the saved filter
+    when the data version changes and build it in memory from the table if
+    the saved one is missing, unreadable or out of date. Only update runs
+    write the file.
+
+    :param table_name: The name of the table, which must have a 'cell'
+        column.
+    :type table_name: str
+    """
+
+    def __init__(self, table_name, error_rate=0.01):
+        self.table_name = table_name
+        self.error_rate = error_rate
+        self.version = None
+        self.filter = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return f"{SQLController.PATH}.{self.table_name}.bloom.npz"
+
+    def reload(self):
+        """This method is used to load or build the filter again if the data
+            version has changed since the last load."""
+
+        controller = SQLController(self.table_name)
+        try:
+            version = controller.data_version()
+            if version == self.version:
+                return
+            with self._lock:
+                if version == self.version:
+                    return
+                try:
+                    bloom_filter, metadata = BloomFilter.load(self.path)
+                except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+                    # Missing, or torn by an update run which failed to write it
+                    metadata = {}
+                if metadata.get("version") == version:
+                    self.filter = bloom_filter
+                    self.version = version
+                    return
+                self._build(controller)
+                self.version = version
+        finally:
+            controller.close()
+
+    def _build(self, controller):
+        controller.cursor.execute(f"SELECT cell FROM {self.table_name} WHERE cell IS NOT NULL")
+        cells = np.fromiter((data[0] for data in controller.cursor), dtype=np.int64)
+        self.filter = BloomFilter(capacity=max(2 * len(cells), 1024), error_rate=self.error_rate)
+        self.filter.add(cells)
+
+    def _save(self):
+        # A temporary file of its own, so that update runs saving at the same
+        # time never publish a mixed file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)),
+                                         prefix=f"{os.path.basename(self.path)}.",
+                                         suffix=".tmp", delete=False) as file:
+            temporary_path = file.name
+            try:
+                self.filter.save(file, version=self.version)
+            except BaseException:
+                file.close()
+                os.remove(temporary_path)
+                raise
+        # Readable by the web workers, unlike the default mode of the file
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, self.path)
+
+    def select(self, cells):
+        """This method is used to take out the cells which have no records
+            for sure.
+
+        :param cells: keys of grid cells, see 'grid.cell'
+        :type cells: list of int
+
+        :return: the cells which may have records
+        :rtype: list of int"""
+
+        self.reload()
+        cells = np.asarray(cells, dtype=np.int64)
+        return cells[self.filter.contains(cells)].tolist()
+
+    def add(self, cells):
+        """This method is used by update runs to add the cells they write."""
+
+        if self.filter is None:
+            self.reload()
+        with self._lock:
+            self.filter.add(cells)
+
+    def save(self, version):
+        """This method is used by update runs to save the filter with the new
+            data version, after 'SQLController.bump_data_version'."""
+
+        if self.filter is None:
+            return
+        with self._lock:
+            self.version = version
+            if self.filter.count > self.filter.capacity:
+                # Too many added cells raise the error rate, so start over
+                controller = SQLController(self.table_name)
+                self._build(controller)
+                controller.close()
+            self._save()
+
+    def stats(self):
+        return {
+            "size": None if self.filter is None else self.filter.size,
+            "count": None if self.filter is None else self.filter.count,
+            "capacity": None if self.filter is None else self.filter.capacity,
+            "version": self.version,
+        }
+
+TRAFFIC_ACCIDENT_CELL_CACHE = CellCache(get_version=data_version)
+EARTHQUAKE_CELL_CACHE = CellCache(get_version=data_version)
+TRAFFIC_ACCIDENT_CELL_FILTER = CellFilter("risk_traffic_accident")
+EARTHQUAKE_CELL_FILTER = CellFilter("risk_earthquake")
+
+def save_cell_filters(version):
+    TRAFFIC_ACCIDENT_CELL_FILTER.save(version)
+    EARTHQUAKE_CELL_FILTER.save(version)
+
+def traffic_accident_rows(cells):
+    """This method is used to get the rows of 'risk_traffic_accident' of a set
+        of grid cells. Cells are read from the per-cell cache first and only
+        the cells which are not cached are queried.
+
+    :param cells: keys of grid cells, see 'grid.cell'
+    :type cells: iterable of int
+
+    :return: one row for each cell with traffic accidents
+    :rtype: list of tuples"""
+
+    found, missing = TRAFFIC_ACCIDENT_CELL_CACHE.get_many(cells)
+    if missing:
+        values = dict.fromkeys(missing)
+        if USE_CELL_FILTER:
+            missing = TRAFFIC_ACCIDENT_CELL_FILTER.select(missing)
+        if missing:
+            controller = TrafficAccidentSQLController()
+            for data in controller.select_from_cells(missing):
+                values[data[8]] = data
+            controller.close()
+        TRAFFIC_ACCIDENT_CELL_CACHE.set_many(values)
+        found.update(values)
+    return [data for data in found.values() if data is not None]
+
+def earthquake_rows(cells):
+    """This method is used to get the rows of 'risk_earthquake' of a set of
+        grid cells through the per-cell cache, see 'traffic_accident_rows'.
+
+    :return: the rows of the earthquakes whose epicenters are in the cells
+    :rtype: list of tuples"""
+
+    found, missing = EARTHQUAKE_CELL_CACHE.get_many(cells)
+    if missing:
+        values = dict.fromkeys(missing)
+        if USE_CELL_FILTER:
+            missing = EARTHQUAKE_CELL_FILTER.select(missing)
+        if missing:
+            controller = EarthquakeSQLController()
+            for data in controller.select_from_cells(missing):
+                if values[data[7]] is None:
+                    values[data[7]] = []
+                values[data[7]].append(data)
+            controller.close()
+        EARTHQUAKE_CELL_CACHE.set_many(values)
+        found.update(values)
+    return [data for rows in found.values() if rows is not None for data in rows]
+
+_traffic_accident_index = None
+
+def traffic_accident_index():
+    """This method is used to get the in-memory traffic accident index of the
+        current worker process."""
+
+    global _traffic_accident_index
+    if _traffic_accident_index is None:
+        _traffic_accident_index = TrafficAccidentIndex()
+    return _traffic_accident_index
+
 class PedestrianHellSQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "area_1": str,
+        "area_2": str,
+        "number": int,
+        "total_fatality": int,
+        "total_injury": int,
+        "pedestrian_fatality": int,
+        "pedestrian_injury": int,
+    }
+    COUNT_COLUMNS = TrafficAccidentSQLController.COUNT_COLUMNS
+
     def __init__(self):
         self.table_name = "risk_pedestrian_hell"
         super().__init__(self.table_name)
@@ -936,38 +1682,58 @@ class PedestrianHellSQLController(SQLController):
         self.existing_id = self.administrative_area_id(area_1,
                                                        area_2)
         if self.existing_id:
-            number = self.select(self.existing_id, "number") + 1
-            total_fatality += self.select(self.existing_id, "total_fatality")
-            total_injury += self.select(self.existing_id, "total_injury")
-            pedestrian_fatality += self.select(self.existing_id, "pedestrian_fatality")
-            pedestrian_injury += self.select(self.existing_id, "pedestrian_injury")
-            sql = f"""UPDATE {self.table_name}
-                    SET number = {number},
-                    total_fatality = {total_fatality},
-                    total_injury = {total_injury},
-                    pedestrian_fatality = {pedestrian_fatality},
-                    pedestrian_injury = {pedestrian_injury} WHERE id = {self.existing_id}"""
-            self.cursor.execute(sql)
+            sql = query.update_add(self.table_name, self.COUNT_COLUMNS)
+            self.cursor.execute(sql, (1, total_fatality, total_injury,
+                                      pedestrian_fatality, pedestrian_injury,
+                                      self.existing_id))
         else:
-            sql = f"""INSERT INTO {self.table_name} (
-                    area_1,
-                    area_2,
-                    number,
-                    total_fatality,
-                    total_injury,
-                    pedestrian_fatality,
-                    pedestrian_injury) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+            sql = query.insert(self.table_name, ("area_1", "area_2") + self.COUNT_COLUMNS)
             self.cursor.execute(sql, (area_1,
                                       area_2,
                                       1, total_fatality, total_injury,
                                       pedestrian_fatality, pedestrian_injury))
         self.conn.commit()
 
+    def bulk_new(self, area_1s, area_2s, fatalities, injuries, includes_pedestrian):
+        """This method is the bulk version of 'new'. The accidents are added
+            up per administrative area in memory and written with one upsert
+            per area. Nothing is committed, see
+            'TrafficAccidentSQLController.bulk_new'.
+
+        :return: The number of rows written.
+        :rtype: int"""
+
+        return self.bulk_add(self.aggregate(area_1s, area_2s, fatalities, injuries, includes_pedestrian))
+
+    @staticmethod
+    def aggregate(area_1s, area_2s, fatalities, injuries, includes_pedestrian):
+        """This method is used to add up the accidents per administrative
+            area, see 'RunningCounts' to add up the results of several chunks.
+
+        :return: 'COUNT_COLUMNS' indexed by area_1 and area_2
+        :rtype: pandas.DataFrame"""
+
+        counts = accident_counts(fatalities, injuries, includes_pedestrian)
+        counts["area_1"] = np.asarray(area_1s, dtype=object)
+        counts["area_2"] = np.asarray(area_2s, dtype=object)
+        return counts.groupby(["area_1", "area_2"], sort=True).sum()
+
+    def bulk_add(self, counts):
+        """This method is used to write the result of 'aggregate' with one
+            upsert per area. Nothing is committed.
+
+        :return: The number of rows written.
+        :rtype: int"""
+
+        counts = counts.reset_index()
+        rows = zip(*(counts[column].tolist() for column in ("area_1", "area_2") + self.COUNT_COLUMNS))
+        sql = query.upsert_add(self.table_name, ("area_1", "area_2"), self.COUNT_COLUMNS)
+        self.cursor.executemany(sql, rows)
+        return len(counts)
+
     def administrative_area_id(self, area_1, area_2):
-        sql = f"""SELECT * FROM {self.table_name}
-                    WHERE area_1 = '{area_1}'
-                    AND area_2 = '{area_2}'"""
-        self.cursor.execute(sql)
+        sql = query.select(self.table_name, ("id",), where=("area_1", "area_2"))
+        self.cursor.execute(sql, (area_1, area_2))
         data = self.cursor.fetchone()
         if data:
             return data[0]
@@ -975,45 +1741,182 @@ class PedestrianHellSQLController(SQLController):
             return None
 
 class EarthquakeSQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "date": str,
+        "time": str,
+        "latitude": float,
+        "longitude": float,
+        "magnitude": float,
+        "depth": float,
+        "cell": int,
+        "key": str,
+    }
+    EVENT_COLUMNS = ("key", "date", "time", "latitude", "longitude", "cell", "magnitude", "depth")
+
     def __init__(self):
         self.table_name = "risk_earthquake"
         super().__init__(self.table_name)
 
     def new(self, date, time, latitude, longitude, magnitude, depth):
-        sql = f"""INSERT INTO {self.table_name} (
-                date, time, latitude, longitude,
-                magnitude, depth) VALUES (?, ?, ?, ?, ?, ?)"""
-        self.cursor.execute(sql, (date, str(time), latitude, longitude, magnitude, depth))
-        self.conn.commit()
+        """This method is used to add an earthquake event, unless an event of
+            the same key is in the table, see 'risk.earthquake_key'. It is
+            committed with a new data version, see
+            'TrafficAccidentSQLController.new'."""
+
+        sql = query.insert_ignore(self.table_name, self.EVENT_COLUMNS, ("key",))
+        cell = grid.cell(latitude, longitude, grid.EARTHQUAKE_DIFFERENCE)
+        self.cursor.execute(sql, (risk.earthquake_key(date, time, latitude, longitude),
+                                  str(date), str(time), latitude, longitude, cell, magnitude, depth))
+        EARTHQUAKE_CELL_FILTER.add([cell])
+        save_cell_filters(self.bump_data_version())
+
+    def bulk_new(self, dates, times, latitudes, longitudes, magnitudes, depths):
+        """This method is the bulk version of 'new'. The csv files have a row
+            per felt area of an event, so the rows are deduplicated by event
+            key first, and events already in the table are skipped. Nothing
+            is committed, see 'TrafficAccidentSQLController.bulk_new'.
+
+        :return: The event id of every row, in the order of the rows.
+        :rtype: numpy.ndarray of int64"""
+
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        dates = np.asarray(dates, dtype=object).astype(str)
+        times = np.asarray(times, dtype=object).astype(str)
+        keys = np.array([risk.earthquake_key(*event) for event in zip(dates, times, latitudes, longitudes)],
+                        dtype=object)
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+        cells = grid.cell(latitudes[first], longitudes[first], grid.EARTHQUAKE_DIFFERENCE)
+        rows = zip(keys[first].tolist(), dates[first].tolist(), times[first].tolist(),
+                   latitudes[first].tolist(), longitudes[first].tolist(), cells.tolist(),
+                   np.asarray(magnitudes, dtype=np.float64)[first].tolist(),
+                   np.asarray(depths, dtype=np.float64)[first].tolist())
+        self.cursor.executemany(query.insert_ignore(self.table_name, self.EVENT_COLUMNS, ("key",)), rows)
+        EARTHQUAKE_CELL_FILTER.add(cells)
+
+        ids = self.key_ids(keys[first].tolist())
+        return np.array([ids[key] for key in keys], dtype=np.int64)
+
+    def key_ids(self, keys):
+        """This method is used to get the ids of a set of event keys.
+
+        :rtype: dict"""
+
+        ids = {}
+        for index in range(0, len(keys), CELL_CHUNK_SIZE):
+            chunk = query.pad(keys[index: index + CELL_CHUNK_SIZE])
+            self.cursor.execute(query.select_in(self.table_name, ("key", "id"), "key", len(chunk)), chunk)
+            ids.update(self.cursor.fetchall())
+        return ids
+
+class EarthquakeAreaIntensitySQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "event_id": int,
+        "area": str,
+        "intensity": str,
+        "pga": float,
+    }
+
+    def __init__(self):
+        self.table_name = "risk_earthquake_area_intensity"
+        super().__init__(self.table_name)
+
+    def bulk_new(self, event_ids, areas, intensities):
+        """This method is used to add the intensities of events in their
+            felt areas. Rows already in the table are skipped, so that the
+            same month can be ingested again. Nothing is committed, see
+            'TrafficAccidentSQLController.bulk_new'.
+
+        :param event_ids: see 'EarthquakeSQLController.bulk_new'
+        :type event_ids: numpy.ndarray of int64
+
+        :return: Whether each row is new, e.g. to add only the new rows to
+            'risk_earthquake_intensity'.
+        :rtype: numpy.ndarray of bool"""
+
+        data = pd.DataFrame({"event_id": np.asarray(event_ids, dtype=np.int64),
+                             "area": np.asarray(areas, dtype=object),
+                             "intensity": np.asarray(intensities, dtype=object)})
+        existing = set()
+        event_ids = np.unique(data["event_id"].to_numpy()).tolist()
+        for index in range(0, len(event_ids), CELL_CHUNK_SIZE):
+            chunk = query.pad(event_ids[index: index + CELL_CHUNK_SIZE])
+            self.cursor.execute(query.select_in(self.table_name, ("event_id", "area"), "event_id", len(chunk)),
+                                chunk)
+            existing.update(self.cursor.fetchall())
+        is_new = ~np.array([pair in existing for pair in zip(data["event_id"].tolist(), data["area"].tolist())],
+                           dtype=bool)
+        # An area felt twice in the rows of one event is kept once
+        is_new &= ~data.duplicated(["event_id", "area"]).to_numpy()
+
+        new = data[is_new]
+        pgas = {intensity: risk.intensity_to_pga(intensity) for intensity in new["intensity"].unique()}
+        rows = zip(new["event_id"].tolist(), new["area"].tolist(), new["intensity"].tolist(),
+                   new["intensity"].map(pgas).tolist())
+        self.cursor.executemany(query.insert(self.table_name, ("event_id", "area", "intensity", "pga")), rows)
+        return is_new
 
 class EarthquakeIntensitySQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "area": str,
+        "number": int,
+        "pga_sum": float,
+    }
+
     def __init__(self):
         self.table_name = "risk_earthquake_intensity"
         super().__init__(self.table_name)
 
     def new(self, area, intensity):
-        self.existing_id = self.area_id(area)
-        if self.existing_id:
-            number = self.select(self.existing_id, "number")
-            avg_pga = self.select(self.existing_id, "pga")
-            total_pga = avg_pga * number + risk.intensity_to_pga(intensity)
-            number += 1
-            avg_pga = total_pga / number
-            avg_intensity = risk.pga_to_intensity(avg_pga)
-            sql = f"""UPDATE {self.table_name} SET number = {number},
-                    intensity = '{avg_intensity}', pga = {avg_pga}
-                    WHERE id = {self.existing_id}"""
-            self.cursor.execute(sql)
-        else:
-            sql = f"""INSERT INTO {self.table_name} (area, number, intensity,
-                    pga) VALUES (?, ?, ?, ?)"""
-            pga = risk.intensity_to_pga(intensity)
-            self.cursor.execute(sql, (area, 1, intensity, pga))
+        sql = query.upsert_add(self.table_name, ("area",), ("number", "pga_sum"))
+        self.cursor.execute(sql, (area, 1, risk.intensity_to_pga(intensity)))
         self.conn.commit()
 
+    def bulk_new(self, areas, intensities):
+        """This method is the bulk version of 'new'. The records are added up
+            per area in memory and written with one upsert per area. Nothing
+            is committed, see 'TrafficAccidentSQLController.bulk_new'.
+
+        :return: The number of rows written.
+        :rtype: int"""
+
+        data = pd.DataFrame({"area": np.asarray(areas, dtype=object),
+                             "intensity": np.asarray(intensities, dtype=object)})
+        pgas = {intensity: risk.intensity_to_pga(intensity) for intensity in data["intensity"].unique()}
+        data["pga"] = data["intensity"].map(pgas).astype(np.float64)
+        sums = data.groupby("area", sort=True)["pga"].agg(["size", "sum"])
+        rows = zip(sums.index.tolist(), sums["size"].tolist(), sums["sum"].tolist())
+        self.cursor.executemany(query.upsert_add(self.table_name, ("area",), ("number", "pga_sum")), rows)
+        return len(sums)
+
+    def pga(self, area):
+        """This method is used to get the average PGA of the records of an
+            area, or None if the area has no records."""
+
+        sql = query.select(self.table_name, ("number", "pga_sum"), where=("area",))
+        self.cursor.execute(sql, (area,))
+        data = self.cursor.fetchone()
+        if data and data[0]:
+            return data[1] / data[0]
+        else:
+            return None
+
+    def intensity(self, area):
+        """This method is used to get the intensity of the average PGA of an
+            area, see 'risk.pga_to_intensity'."""
+
+        pga = self.pga(area)
+        if pga is None:
+            return None
+        return risk.pga_to_intensity(pga)
+
     def area_id(self, area):
-        sql = f"SELECT * FROM {self.table_name} WHERE area = '{area}'"
-        self.cursor.execute(sql)
+        sql = query.select(self.table_name, ("id",), where=("area",))
+        self.cursor.execute(sql, (area,))
         data = self.cursor.fetchone()
         if data:
             return data[0]
@@ -1021,20 +1924,45 @@ class EarthquakeIntensitySQLController(SQLController):
             return None
 
 class AttractionSQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "name": str,
+        "latitude": float,
+        "longitude": float,
+        "area_1": str,
+        "area_2": str,
+        "address": str,
+        "image": str,
+    }
+
     def __init__(self):
         self.table_name = "map_hotspot"
         super().__init__(self.table_name)
 
     def new(self, name, latitude, longitude, area_1, area_2, address, image):
         if not self.select_from_coordinate(latitude, longitude):
-            sql = f"""INSERT INTO {self.table_name} (
-                    name, latitude, longitude, area_1, area_2,
-                    address, image) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+            sql = query.insert(self.table_name, ("name", "latitude", "longitude", "area_1", "area_2",
+                                                  "address", "image"))
             self.cursor.execute(sql, (name, latitude, longitude, area_1, area_2,
                                       address, image))
             self.conn.commit()
 
 class RestaurantSQLController(SQLController):
+    COLUMNS = {
+        "id": int,
+        "name": str,
+        "latitude": float,
+        "longitude": float,
+        "area_1": str,
+        "area_2": str,
+        "address": str,
+        "phone": str,
+        "opening_hours": str,
+        "rating": float,
+        "avg_price": int,
+        "image": str,
+    }
+
     def __init__(self):
         self.table_name = "map_restaurant"
         super().__init__(self.table_name)
@@ -1042,9 +1970,9 @@ class RestaurantSQLController(SQLController):
     def new(self, name, latitude, longitude, area_1, area_2, address, phone,
                 opening_hours, rating, avg_price, image):
         if not self.select_from_coordinate(latitude, longitude):
-            sql = f"""INSERT INTO {self.table_name} (name, latitude, longitude,
-                    area_1, area_2, address, phone, opening_hours, rating,
-                    avg_price, image) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+            sql = query.insert(self.table_name, ("name", "latitude", "longitude", "area_1", "area_2",
+                                                  "address", "phone", "opening_hours", "rating",
+                                                  "avg_price", "image"))
             self.cursor.execute(sql, (name, latitude, longitude, area_1, area_2,
                                       address, phone, opening_hours, rating,
                                       avg_price, image))
@@ -1091,26 +2019,47 @@ class UpdateTrafficAccidentData:
                 self.tracking_month += 1
 
     def update_data(self):
-        self.accident = CarAccident(year=self.tracking_year,
-                                    month=self.tracking_month,
-                                    rank=self.tracking_rank)
+        """This method is used to add up the accidents of the tracked month
+            per grid cell and per administrative area, and to upsert both
+            aggregates and the new data version in one transaction.
+
+            The csv files are read in chunks of 'CAR_ACCIDENT_CHUNK_SIZE'
+            rows, whose counts are added up as they are read, so only one
+            chunk and the running counts are in memory at once."""
+
+        start_time = time.perf_counter()
+        self.number_of_data = 0
+        cell_counts = RunningCounts()
+        area_counts = RunningCounts()
+        for accident in CarAccident.chunks(year=self.tracking_year,
+                                           month=self.tracking_month,
+                                           rank=self.tracking_rank):
+            self.number_of_data += len(accident.data)
+            cell_counts.add(TrafficAccidentSQLController.aggregate(
+                accident.latitude(), accident.longitude(),
+                accident.fatality(), accident.injury(),
+                accident.includes_pedestrian()))
+            area_counts.add(PedestrianHellSQLController.aggregate(
+                accident.area_1(), accident.area_2(),
+                accident.fatality(), accident.injury(),
+                accident.includes_pedestrian()))
         self.traffic_controller = TrafficAccidentSQLController()
         self.ped_hell_controller = PedestrianHellSQLController()
-        self.number_of_data = len(self.accident.data)
-        for i in range(self.number_of_data):
-            latitude = self.accident.latitude(i)
-            longitude = self.accident.longitude(i)
-            fatality = self.accident.fatality(i)
-            injury = self.accident.injury(i)
-            area_1 = self.accident.area_1(i)
-            area_2 = self.accident.area_2(i)
-            includes_pedestrian = self.accident.includes_pedestrian(i)
-            self.traffic_controller.new(latitude, longitude,
-                                        fatality, injury, includes_pedestrian)
-            self.ped_hell_controller.new(area_1, area_2,
-                                         fatality, injury, includes_pedestrian)
-        self.traffic_controller.close()
-        self.ped_hell_controller.close()
+        self.number_of_rows = 0
+        try:
+            # Both controllers share the connection of the thread
+            if self.number_of_data:
+                self.number_of_rows += self.traffic_controller.bulk_add(cell_counts.result())
+                self.number_of_rows += self.ped_hell_controller.bulk_add(area_counts.result())
+            # 'bump_data_version' commits the transaction, which is rolled
+            # back by 'close' if anything fails before
+            version = self.traffic_controller.bump_data_version()
+        finally:
+            self.ped_hell_controller.close()
+            self.traffic_controller.close()
+        self.execution_time = time.perf_counter() - start_time
+        self.rows_per_second = self.number_of_data / self.execution_time if self.execution_time else None
+        save_cell_filters(version)
 
     def update_tracking_data(self):
         self.tracking_data["sqlite3"]["traffic_accident"]["tracking_year"] = self.tracking_year
@@ -1156,30 +2105,28 @@ class UpdateEarthquakeData:
         except:
             return
         self.earthquake_controller = EarthquakeSQLController()
+        self.area_intensity_controller = EarthquakeAreaIntensitySQLController()
         self.earthquake_intensity_controller = EarthquakeIntensitySQLController()
         self.number_of_data = self.earthquake.size
-        check_date = check_time = 0
-        for index in range(self.earthquake.starting_index, self.earthquake.ending_index):
-            date = self.earthquake.date(index)
-            time = self.earthquake.time(index)
-            latitude = self.earthquake.latitude(index)
-            longitude = self.earthquake.longitude(index)
-            magnitude = self.earthquake.magnitude(index)
-            depth = self.earthquake.depth(index)
-            area = self.earthquake.area(index)
-            intensity = self.earthquake.intensity(index)
-
-            self.earthquake_intensity_controller.new(area, intensity)
-            if check_date == date and check_time == time:
-                continue
-            else:
-                self.earthquake_controller.new(date, time, latitude, longitude, magnitude, depth)
-                check_date = date
-                check_time = time
-
-        self.earthquake_controller.close()
-        self.earthquake_intensity_controller.close()
+        try:
+            # The controllers share the connection of the thread
+            event_ids = self.earthquake_controller.bulk_new(
+                self.earthquake.date(), self.earthquake.time(),
+                self.earthquake.latitude(), self.earthquake.longitude(),
+                self.earthquake.magnitude(), self.earthquake.depth())
+            is_new = self.area_intensity_controller.bulk_new(
+                event_ids, self.earthquake.area(), self.earthquake.intensity())
+            self.earthquake_intensity_controller.bulk_new(self.earthquake.area()[is_new],
+                                                          self.earthquake.intensity()[is_new])
+            # 'bump_data_version' commits the transaction
+            version = self.earthquake_controller.bump_data_version()
+        finally:
+            self.earthquake_intensity_controller.close()
+            self.area_intensity_controller.close()
+            self.earthquake_controller.close()
+        save_cell_filters(version)
         self.update_tracking_data()
+        earthquake_store().refresh()
 
     def update_tracking_data(self):
         self.tracking_data["sqlite3"]["earthquake"]["tracking_year"] = self.tracking_year
@@ -1263,6 +2210,18 @@ def test_CarAccident():
     return accident.area_2()
     pass
 
+def test_CarAccident_chunks():
+    number = 0
+    cell_counts = RunningCounts()
+    for accident in CarAccident.chunks(year=111, month=2, rank=2, chunksize=10000):
+        number += len(accident.data)
+        cell_counts.add(TrafficAccidentSQLController.aggregate(
+            accident.latitude(), accident.longitude(),
+            accident.fatality(), accident.injury(),
+            accident.includes_pedestrian()))
+    print(number, len(CarAccident(year=111, month=2, rank=2).data))
+    print(cell_counts.result())
+
 def test_TrafficAccident():
     controller = TrafficAccidentSQLController()
     test_latitude = 24.4389
@@ -1286,6 +2245,14 @@ def test_Earthquake():
     # controller.new(area, intensity)
     pass
 
+def test_EarthquakeStore():
+    store = earthquake_store()
+    print(store.refresh(), len(store.frame))
+    earthquakes = Earthquake.range("1999-09-20", "1999-09-22", bbox=(23.5, 120.5, 24.2, 121.2))
+    print(len(earthquakes), earthquakes.magnitude().max())
+    print(earthquakes.date(0), earthquakes.time(0), earthquakes.area(0), earthquakes.intensity(0))
+    pass
+
 def test_Attraction():
     attraction = Attraction()
     attr_id = None
@@ -1300,14 +2267,45 @@ def test_Restaurant():
     print(restaurant.address())
     pass
 
+def test_query_plans(repeat=1000):
+    """This method is used to show the query plans and the average times of
+        the lookups of each table, e.g. before and after migrating the
+        indexes of '0005_index'."""
+
+    coordinate = Coordinate(25.0338, 121.5646)
+    lookups = [
+        (TrafficAccidentSQLController, ("latitude", "longitude"), (coordinate.latitude_grid, coordinate.longitude_grid)),
+        (TrafficAccidentSQLController, ("cell",), (coordinate.cell,)),
+        (EarthquakeSQLController, ("cell",), (coordinate.earthquake_cell,)),
+        (PedestrianHellSQLController, ("area_1", "area_2"), ("臺北市", "大安區")),
+        (AttractionSQLController, ("area_1", "area_2"), ("臺北市", "大安區")),
+        (AttractionSQLController, ("latitude", "longitude"), (25.0338, 121.5646)),
+        (RestaurantSQLController, ("area_1", "area_2"), ("臺北市", "大安區")),
+        (RestaurantSQLController, ("latitude", "longitude"), (25.0338, 121.5646)),
+    ]
+    for controller_class, columns, values in lookups:
+        controller = controller_class()
+        sql = query.select(controller.table_name, where=columns)
+        controller.cursor.execute("EXPLAIN QUERY PLAN " + sql, values)
+        plan = "; ".join(data[-1] for data in controller.cursor.fetchall())
+        start = datetime.now()
+        for _ in range(repeat):
+            controller.cursor.execute(sql, values).fetchall()
+        elapsed = (datetime.now() - start).total_seconds() / repeat * 1e6
+        print(f"{controller.table_name} {columns}: {plan} ({elapsed:.1f} us)")
+        controller.close()
+
 
 if __name__ == "__main__":
     # test_Coordinate()
     # test_CarAccident()
+    # test_CarAccident_chunks()
     # test_Attraction()
     # test_TrafficAccident()
     # test_Earthquake()
+    # test_EarthquakeStore()
     # test_Restaurant()
+    # test_query_plans()
     pass
 
 
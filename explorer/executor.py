@@ -0,0 +1,190 @@
+"""
+This module is used to run the blocking risk lookups of route requests in one
+bounded thread pool per worker process
+
+Tasks are grouped by a task type, e.g. 'traffic_accident' or 'earthquake',
+for the metrics. A route is looked up with one task per chunk of cells, never
+one task per cell. When more tasks are waiting than the queue allows, new
+tasks are rejected with 'ExecutorBusyError' instead of piling up.
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+from collections import defaultdict
+
+__all__ = ["ExecutorBusyError", "RiskExecutor"]
+
+
+RISK_EXECUTOR_WORKERS = int(os.getenv("RISK_EXECUTOR_WORKERS", "8"))
+# The number of tasks which may wait for a free thread
+RISK_EXECUTOR_QUEUE_SIZE = int(os.getenv("RISK_EXECUTOR_QUEUE_SIZE", "256"))
+# How long blocking submissions wait for a free place in the queue
+RISK_EXECUTOR_QUEUE_TIMEOUT = float(os.getenv("RISK_EXECUTOR_QUEUE_TIMEOUT", "5")) # seconds
+
+
+class ExecutorBusyError(Exception):
+    def __init__(self, task_type):
+        super().__init__(f"The queue of the risk executor is full, '{task_type}' is rejected")
+
+class _TaskMetrics:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_run_time = 0.0
+
+    def stats(self):
+        finished = self.completed + self.failed
+        return {
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "average_wait_time": self.wait_time / finished if finished else None,
+            "average_run_time": self.run_time / finished if finished else None,
+            "max_run_time": self.max_run_time,
+        }
+
+class RiskExecutor:
+    """This class is used to run blocking functions in a shared thread pool
+        with a limited queue.
+
+    :param max_workers: The number of threads.
+    :type max_workers: int
+
+    :param queue_size: The number of tasks which may wait for a free thread.
+    :type queue_size: int
+
+    :param queue_timeout: How long blocking submissions wait for a free place
+        in the queue before 'ExecutorBusyError' is raised.
+    :type queue_timeout: float
+    """
+
+    def __init__(self, max_workers=RISK_EXECUTOR_WORKERS, queue_size=RISK_EXECUTOR_QUEUE_SIZE,
+                 queue_timeout=RISK_EXECUTOR_QUEUE_TIMEOUT, thread_name_prefix="risk"):
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._metrics = defaultdict(_TaskMetrics)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+    def _acquire(self, task_type, block):
+        timeout = self.queue_timeout if block else None
+        if not self._slots.acquire(blocking=block, timeout=timeout):
+            self._reject(task_type)
+
+    def _reject(self, task_type):
+        with self._lock:
+            self._metrics[task_type].rejected += 1
+        raise ExecutorBusyError(task_type)
+
+    def _run(self, task_type, submitted_at, function, args):
+        started_at = time.monotonic()
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        failed = True
+        try:
+            result = function(*args)
+            failed = False
+            return result
+        finally:
+            run_time = time.monotonic() - started_at
+            with self._lock:
+                self._running -= 1
+                metrics = self._metrics[task_type]
+                if failed:
+                    metrics.failed += 1
+                else:
+                    metrics.completed += 1
+                metrics.wait_time += started_at - submitted_at
+                metrics.run_time += run_time
+                metrics.max_run_time = max(metrics.max_run_time, run_time)
+            self._slots.release()
+
+    def _submit(self, task_type, function, args):
+        with self._lock:
+            self._metrics[task_type].submitted += 1
+            self._pending += 1
+        future = self._executor.submit(self._run, task_type, time.monotonic(), function, args)
+        future.add_done_callback(lambda future: self._cancel(task_type, future))
+        return future
+
+    def _cancel(self, task_type, future):
+        # A task cancelled while it waits in the queue never runs '_run', so
+        # its place in the queue is given back here
+        if not future.cancelled():
+            return
+        with self._lock:
+            self._pending -= 1
+            self._metrics[task_type].cancelled += 1
+        self._slots.release()
+
+    def submit(self, task_type, function, *args, block=True):
+        """This method is used to run a function in the pool.
+
+        :param task_type: The name of the task in the metrics.
+        :type task_type: str
+
+        :param block: Whether to wait up to 'queue_timeout' for a free place
+            in the queue. Use 'run' in async code instead.
+        :type block: bool
+
+        :rtype: concurrent.futures.Future"""
+
+        self._acquire(task_type, block)
+        return self._submit(task_type, function, args)
+
+    async def run(self, task_type, function, *args):
+        """This method is the async version of 'submit', which waits for a
+            free place in the queue without blocking the event loop."""
+
+        deadline = time.monotonic() + self.queue_timeout
+        delay = 0.001
+        while not self._slots.acquire(blocking=False):
+            if time.monotonic() >= deadline:
+                self._reject(task_type)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return await asyncio.wrap_future(self._submit(task_type, function, args))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queue_size": self.queue_size,
+                "pending": self._pending,
+                "running": self._running,
+                "tasks": {task_type: metrics.stats() for task_type, metrics in self._metrics.items()},
+            }
+
+
+def test_RiskExecutor():
+    executor = RiskExecutor(max_workers=2, queue_size=1, queue_timeout=0.1)
+    futures = [executor.submit("sleep", time.sleep, 0.2) for _ in range(3)]
+    try:
+        executor.submit("sleep", time.sleep, 0.2)
+    except ExecutorBusyError as e:
+        print(e)
+    # The queued task gives its place back, so another one is accepted
+    print(futures[-1].cancel())
+    futures[-1] = executor.submit("sleep", time.sleep, 0.2)
+    concurrent.futures.wait(futures)
+    print(asyncio.run(executor.run("sum", sum, [1, 2, 3])))
+    print(executor.stats())
+
+if __name__ == "__main__":
+    # test_RiskExecutor()
+    pass
@@ -0,0 +1,301 @@
+"""
+This module is used to map latitudes and longitudes to integer grid cells
+
+A grid cell is addressed by a single int64 key which packs the latitude index
+and the longitude index of the cell at a given degree difference. Keys are
+used by 'risk_traffic_accident' and 'risk_earthquake' so that every spatial
+lookup is an integer match instead of a float comparison.
+
+Every function works on scalars and on NumPy arrays.
+"""
+import math
+import numpy as np
+from functools import lru_cache
+from operator import itemgetter
+
+__all__ = ["TRAFFIC_ACCIDENT_DIFFERENCE", "EARTHQUAKE_DIFFERENCE",
+           "InvalidCoordinateError", "encode", "decode", "cell", "cell_index",
+           "cell_coordinate", "route_array", "validate", "snap", "traverse",
+           "buffer"]
+
+
+TRAFFIC_ACCIDENT_DIFFERENCE = 0.0001
+EARTHQUAKE_DIFFERENCE = 0.01
+
+# The longitude index is shifted into the lower 32 bits of a key
+_LONGITUDE_OFFSET = 1 << 31
+_LONGITUDE_MASK = (1 << 32) - 1
+
+EARTH_RADIUS = 6371008.8 # meters
+# The widest travel mode corridor, which bounds the cells of a route
+MAX_BUFFER_M = 25
+# Number of cells dilated at once, which bounds the memory of 'buffer'
+_BUFFER_CHUNK_SIZE = 2000
+
+
+class InvalidCoordinateError(Exception):
+    def __init__(self, message="""Invalid coordinate. Must provide either a single
+                                 iterable or separate latitude and longitude values."""):
+        self.message = message
+        super().__init__(self.message)
+
+@lru_cache(maxsize=None)
+def _decimal_place(difference):
+    power = math.log10(difference)
+    if power > 0:
+        return 0
+    return math.ceil(abs(power))
+
+def encode(degree, difference=TRAFFIC_ACCIDENT_DIFFERENCE):
+    """This method is used to determine the index of the grid line nearest to
+        a degree of latitude or longitude.
+
+    :param degree: The latitude value or the longitude value.
+    :type degree: float or numpy.ndarray
+
+    :param difference: The degree difference between two grid lines.
+    :type difference: float"""
+
+    if np.ndim(degree):
+        return np.rint(np.asarray(degree, dtype=np.float64) / difference).astype(np.int64)
+    return int(round(float(degree) / difference))
+
+def decode(index, difference=TRAFFIC_ACCIDENT_DIFFERENCE):
+    """This method is used to determine the degree of a grid line index."""
+
+    decimal_place = _decimal_place(difference)
+    if np.ndim(index):
+        return np.round(np.asarray(index, dtype=np.int64) * difference, decimal_place)
+    return round(index * difference, decimal_place)
+
+def cell(latitude, longitude, difference=TRAFFIC_ACCIDENT_DIFFERENCE):
+    """This method is used to determine the key of the grid cell containing a
+        coordinate.
+
+    :param latitude: The latitude value.
+    :type latitude: float or numpy.ndarray
+
+    :param longitude: The longitude value.
+    :type longitude: float or numpy.ndarray
+
+    :param difference: The degree difference of the grid, e.g. 0.0001 for
+        traffic accidents and 0.01 for earthquakes.
+    :type difference: float"""
+
+    return cell_index(encode(latitude, difference), encode(longitude, difference))
+
+def cell_index(latitude_index, longitude_index):
+    """This method is used to pack a latitude index and a longitude index into
+        a cell key."""
+
+    return (latitude_index << 32) + (longitude_index + _LONGITUDE_OFFSET)
+
+def cell_coordinate(key, difference=TRAFFIC_ACCIDENT_DIFFERENCE):
+    """This method is used to determine the rounded latitude and longitude of
+        a cell key.
+
+    :return: The latitude value and the longitude value.
+    :rtype: tuple"""
+
+    latitude_index = key >> 32
+    longitude_index = (key & _LONGITUDE_MASK) - _LONGITUDE_OFFSET
+    return decode(latitude_index, difference), decode(longitude_index, difference)
+
+def route_array(coordinates):
+    """This method is used to convert the points of a route to an array.
+
+    :param coordinates: The points of a route.
+    :type coordinates: list of dicts {"lat": 25.0338, "lng": 121.5646}, list
+        of tuples (25.0338, 121.5646), or numpy.ndarray
+
+    :return: The latitudes in the first column and the longitudes in the
+        second column.
+    :rtype: numpy.ndarray with shape (number of points, 2)"""
+
+    if isinstance(coordinates, np.ndarray):
+        return coordinates.astype(np.float64, copy=False).reshape(-1, 2)
+    coordinates = list(coordinates)
+    if coordinates and isinstance(coordinates[0], dict):
+        return np.fromiter(map(itemgetter("lat", "lng"), coordinates),
+                           dtype=np.dtype((np.float64, 2)), count=len(coordinates))
+    return np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+
+def validate(points):
+    """This method is used to check the latitudes and longitudes of an array
+        made by 'route_array'."""
+
+    if not np.all(np.abs(points[:, 0]) <= 90):
+        message = "Invalid latitude value. Must between -90 and 90 degrees."
+        raise InvalidCoordinateError(message)
+    if not np.all(np.abs(points[:, 1]) <= 180):
+        message = "Invalid longitude value. Must between -180 and 180 degrees."
+        raise InvalidCoordinateError(message)
+
+def snap(coordinates, *differences):
+    """This method is used to snap the points of a route to grid cells and
+        take out the duplicated cells in one vectorized pass.
+
+    :param coordinates: The points of a route, see 'route_array'.
+
+    :param *differences: The degree differences of the grids. By default, the
+        traffic accident grid and the earthquake grid.
+    :type *differences: float
+
+    :return: The sorted unique cell keys of each grid.
+    :rtype: tuple of numpy.ndarray"""
+
+    if not differences:
+        differences = (TRAFFIC_ACCIDENT_DIFFERENCE, EARTHQUAKE_DIFFERENCE)
+    points = route_array(coordinates)
+    validate(points)
+    return tuple(np.unique(cell(points[:, 0], points[:, 1], difference))
+                 for difference in differences)
+
+def _crossings(starts, ends):
+    """This method is used to find where the segments cross grid lines of one
+        axis, in grid units where the lines are the integers.
+
+    :return: The segment index and the segment parameter t of each crossing.
+    :rtype: tuple of numpy.ndarray"""
+
+    lower = np.floor(np.minimum(starts, ends)) + 1
+    upper = np.ceil(np.maximum(starts, ends))
+    counts = np.maximum(upper - lower, 0).astype(np.int64)
+    segments = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    lines = lower[segments] + offsets
+    return segments, (lines - starts[segments]) / (ends[segments] - starts[segments])
+
+def _traverse(points, difference):
+    # Shift by half a cell so a cell spans [i, i + 1) like 'encode' rounds
+    u = points[:, 0] / difference + 0.5
+    v = points[:, 1] / difference + 0.5
+    if len(points) < 2:
+        return cell_index(np.floor(u).astype(np.int64), np.floor(v).astype(np.int64))
+
+    u0, u1, v0, v1 = u[:-1], u[1:], v[:-1], v[1:]
+    number_of_segments = len(u0)
+    u_segments, u_t = _crossings(u0, u1)
+    v_segments, v_t = _crossings(v0, v1)
+    segments = np.concatenate([np.arange(number_of_segments), np.arange(number_of_segments),
+                               u_segments, v_segments])
+    t = np.concatenate([np.zeros(number_of_segments), np.ones(number_of_segments), u_t, v_t])
+    order = np.lexsort((t, segments))
+    segments, t = segments[order], t[order]
+
+    # Every interval between two consecutive crossings lies in exactly one
+    # cell, found at its midpoint. Zero-length intervals only touch a corner.
+    is_interval = (segments[1:] == segments[:-1]) & (t[1:] > t[:-1])
+    segments = segments[:-1][is_interval]
+    middles = (t[:-1][is_interval] + t[1:][is_interval]) / 2
+    latitude_index = np.floor(u0[segments] + middles * (u1 - u0)[segments]).astype(np.int64)
+    longitude_index = np.floor(v0[segments] + middles * (v1 - v0)[segments]).astype(np.int64)
+    keys = cell_index(latitude_index, longitude_index)
+    if not len(keys):
+        return cell_index(np.floor(u).astype(np.int64), np.floor(v).astype(np.int64))[:1]
+
+    # Keep the first visit of each cell in route order
+    _, first_index = np.unique(keys, return_index=True)
+    return keys[np.sort(first_index)]
+
+def traverse(coordinates, *differences):
+    """This method is used to walk each segment of a route through the grid
+        and determine every cell the route crosses, not only the cells of its
+        points. A long straight segment thus covers the cells between its two
+        points and a densely sampled curve adds each cell once.
+
+    :param coordinates: The points of a route in order, see 'route_array'.
+
+    :param *differences: The degree differences of the grids. By default, the
+        traffic accident grid and the earthquake grid.
+    :type *differences: float
+
+    :return: The unique cell keys of each grid in the order the route crosses
+        them.
+    :rtype: tuple of numpy.ndarray"""
+
+    if not differences:
+        differences = (TRAFFIC_ACCIDENT_DIFFERENCE, EARTHQUAKE_DIFFERENCE)
+    points = route_array(coordinates)
+    validate(points)
+    if not len(points):
+        return tuple(np.empty(0, dtype=np.int64) for difference in differences)
+    return tuple(_traverse(points, difference) for difference in differences)
+
+@lru_cache(maxsize=None)
+def _stencil(radius_m, difference, latitude):
+    """This method is used to determine the key offsets of the cells within a
+        radius around a cell. The cells are narrower in longitude than in
+        latitude, so the stencil depends on the latitude in whole degrees."""
+
+    height = math.radians(difference) * EARTH_RADIUS
+    width = height * math.cos(math.radians(latitude))
+    rows = int(radius_m // height)
+    columns = int(radius_m // width)
+    latitude_offsets, longitude_offsets = np.mgrid[-rows: rows + 1, -columns: columns + 1]
+    is_inside = (latitude_offsets * height) ** 2 + (longitude_offsets * width) ** 2 <= radius_m ** 2
+    offsets = (latitude_offsets[is_inside].astype(np.int64) << 32) + longitude_offsets[is_inside]
+    offsets.setflags(write=False)
+    return offsets
+
+def buffer(cells, radius_m, difference=TRAFFIC_ACCIDENT_DIFFERENCE):
+    """This method is used to widen the cells of a route to a corridor, i.e.
+        every cell whose center is within a radius of a route cell.
+
+    :param cells: The cell keys of a route, e.g. from 'traverse'.
+    :type cells: numpy.ndarray
+
+    :param radius_m: The half width of the corridor in meters, at most
+        'MAX_BUFFER_M'.
+    :type radius_m: float
+
+    :return: The unique cell keys of the corridor in route order.
+    :rtype: numpy.ndarray"""
+
+    cells = np.asarray(cells, dtype=np.int64)
+    if not radius_m or not len(cells):
+        return cells
+    if not math.isfinite(radius_m) or radius_m < 0 or radius_m > MAX_BUFFER_M:
+        message = f"Invalid buffer. Must be between 0 and {MAX_BUFFER_M} meters."
+        raise ValueError(message)
+
+    latitudes, _ = cell_coordinate(cells, difference)
+    offsets = _stencil(float(radius_m), difference, int(round(float(np.mean(latitudes)))))
+    corridor = []
+    for index in range(0, len(cells), _BUFFER_CHUNK_SIZE):
+        chunk = cells[index: index + _BUFFER_CHUNK_SIZE]
+        keys = (chunk[:, None] + offsets[None, :]).ravel()
+        _, first_index = np.unique(keys, return_index=True)
+        corridor.append(keys[np.sort(first_index)])
+    keys = np.concatenate(corridor)
+    _, first_index = np.unique(keys, return_index=True)
+    return keys[np.sort(first_index)]
+
+
+def test_cell():
+    key = cell(25.03381, 121.56462)
+    print(key, cell_coordinate(key))
+    keys = cell(np.array([25.03381, -33.8688]), np.array([121.56462, -151.2093]), EARTHQUAKE_DIFFERENCE)
+    print(keys, cell_coordinate(keys, EARTHQUAKE_DIFFERENCE))
+
+def test_snap():
+    coordinates = [{"lat": 25.03381, "lng": 121.56462}, {"lat": 25.03379, "lng": 121.56458}]
+    traffic_accident_cells, earthquake_cells = snap(coordinates)
+    print(traffic_accident_cells, earthquake_cells)
+
+def test_traverse():
+    coordinates = [(25.0330, 121.5650), (25.0334, 121.5653), (25.0334, 121.5653), (25.0331, 121.5650)]
+    traffic_accident_cells, = traverse(coordinates, TRAFFIC_ACCIDENT_DIFFERENCE)
+    print(cell_coordinate(traffic_accident_cells))
+
+def test_buffer():
+    coordinates = [(25.0330, 121.5650), (25.0340, 121.5650)]
+    traffic_accident_cells, = traverse(coordinates, TRAFFIC_ACCIDENT_DIFFERENCE)
+    print(len(traffic_accident_cells), len(buffer(traffic_accident_cells, 25)))
+
+if __name__ == "__main__":
+    # test_cell()
+    # test_snap()
+    # test_traverse()
+    # test_buffer()
+    pass
@@ -1,22 +1,28 @@
+import asyncio
 import googlemaps
 import json
+import math
 import sys
 import os
-import concurrent.futures
 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 ### runserver
 from explorer.test_data import *
-from explorer.database import Coordinate, PedestrianHellSQLController, AttractionSQLController, RestaurantSQLController
+from explorer.cache import RouteCache, SingleFlight
+from explorer.executor import RiskExecutor
+from explorer.database import USE_TRAFFIC_ACCIDENT_INDEX, data_version, earthquake_rows, traffic_accident_index, traffic_accident_rows, PedestrianHellSQLController, AttractionSQLController, RestaurantSQLController
+import explorer.grid as grid
 import explorer.risk as risk
 
 ### run python file
 # from test_data import *
 # from database import Coordinate, PedestrianHellSQLController
 
-__all__ = ["GOOGLE_MAPS_API_KEY", "Coordinates", "Direction", "Geocode"]
+__all__ = ["GOOGLE_MAPS_API_KEY", "BUFFER_M", "ROUTE_CACHE", "ROUTE_SINGLE_FLIGHT", "RISK_EXECUTOR", "RISK_LOADING_NUMBER",
+           "run_in_risk_executor", "Coordinates", "Direction", "RouteRisk", "route_risks", "aroute_risks",
+           "Geocode"]
 
 
 """
@@ -71,15 +77,45 @@ def _get_google_maps_api_key():
 
 GOOGLE_MAPS_API_KEY = _get_google_maps_api_key()
 
+# Half width of the route corridor in meters for each travel mode
+BUFFER_M = {
+    "DRIVING": 10,
+    "WALKING": 25,
+}
+
+# Risk results of routes, keyed by their canonical cell sets
+ROUTE_CACHE = RouteCache(get_version=data_version)
+# Identical route requests in flight at the same time, keyed by their route
+# cache keys
+ROUTE_SINGLE_FLIGHT = SingleFlight()
+
+# Every risk lookup runs in this one bounded thread pool of the worker
+# process instead of a new pool per request, see 'explorer.executor'
+RISK_EXECUTOR = RiskExecutor()
+
+# The number of cells of a route looked up at a time
+RISK_LOADING_NUMBER = 100
+
+async def run_in_risk_executor(function, *args, task_type=None):
+    """This method is used to await a blocking function, e.g. a database
+        lookup, in 'RISK_EXECUTOR' without blocking the event loop.
+
+    :param task_type: The name of the task in the metrics of 'RISK_EXECUTOR',
+        by default the name of the function.
+    :type task_type: str"""
+
+    return await RISK_EXECUTOR.run(task_type or function.__name__, function, *args)
+
 
 class Coordinates():
     def __init__(self, coordinates):
-        self.coordinates = coordinates
-        self.grid = []
-        for coordinate in self.coordinates:
-            coord = Coordinate(coordinate)
-            self.grid.append((coord.latitude_grid, coord.longitude_grid))
-        self.grid = list(set(self.grid))
+        self.coordinates = grid.route_array(coordinates)
+        self.cells, self.earthquake_cells = grid.snap(self.coordinates)
+        self.latitude_grid, self.longitude_grid = grid.cell_coordinate(self.cells)
+
+    @property
+    def grid(self):
+        return list(zip(self.latitude_grid.tolist(), self.longitude_grid.tolist()))
 
 class DirectionAPI():
     """Get directions between an origin point and a destination point.
@@ -115,8 +151,7 @@ class DirectionAPI():
         else:
             self.data = DIRECTIONS[0]
         self._coordinates = None
-        self._traffic_accident = None
-        self._earthquake = None
+        self._direction = None
 
     @property
     def overivew_coordinates(self):
@@ -141,129 +176,116 @@ class DirectionAPI():
             route_instructions.append(step['html_instructions'])
         return route_instructions
 
+    @property
+    def direction(self):
+        if self._direction is None:
+            self._direction = Direction(self.coordinates)
+        return self._direction
+
     @property
     def traffic_accident(self):
-        if self._traffic_accident is None:
-            self._traffic_accident = _DirectionTrafficAccidentData(self.coordinates)
-        return self._traffic_accident
+        return self.direction.traffic_accident
 
     @property
     def earthquake(self):
-        if self._earthquake is None:
-            self._earthquake = _DirectionEarthquakeData(self.coordinates)
-        return self._earthquake
+        return self.direction.earthquake
 
 
 class Direction():
-    def __init__(self, coordinates):
-        self.coordinates = []
-        try:
-            for coordinate in coordinates:
-                self.coordinates.append((coordinate["lat"], coordinate["lng"]))
-        except:
-            self.coordinates = coordinates
+    """Get risks along a route.
+
+    :param coordinates: The points of a route in order, see 'grid.route_array'.
+        The cells the route crosses are determined by 'grid.traverse'.
+    :type coordinates: list of dicts, list of tuples, or numpy.ndarray
+
+    :param traffic_accident_cells: Keys of 0.0001 degree grid cells which are
+        already determined, e.g. a chunk of 'grid.traverse' results.
+    :type traffic_accident_cells: numpy.ndarray
+
+    :param earthquake_cells: Keys of 0.01 degree grid cells which are already
+        snapped.
+    :type earthquake_cells: numpy.ndarray
+
+    :param buffer_m: The half width in meters of the corridor around the route
+        in which traffic accidents are counted, see 'grid.buffer' and
+        'BUFFER_M'. By default, only the cells the route crosses are counted.
+    :type buffer_m: float
+    """
+    def __init__(self, coordinates=None, traffic_accident_cells=None, earthquake_cells=None,
+                 buffer_m=0):
+        if coordinates is not None:
+            self.coordinates = grid.route_array(coordinates)
+            traffic_accident_cells, earthquake_cells = grid.traverse(self.coordinates)
+        else:
+            self.coordinates = None
+        if buffer_m and traffic_accident_cells is not None:
+            traffic_accident_cells = grid.buffer(traffic_accident_cells, buffer_m)
+        self.buffer_m = buffer_m
+        self.traffic_accident_cells = traffic_accident_cells
+        self.earthquake_cells = earthquake_cells
         self._traffic_accident = None
         self._earthquake = None
 
     @property
     def traffic_accident(self):
         if self._traffic_accident is None:
-            self._traffic_accident = _DirectionTrafficAccidentData(self.coordinates)
+            self._traffic_accident = _DirectionTrafficAccidentData(self.traffic_accident_cells)
         return self._traffic_accident
 
     @property
     def earthquake(self):
         if self._earthquake is None:
-            self._earthquake = _DirectionEarthquakeData(self.coordinates)
+            self._earthquake = _DirectionEarthquakeData(self.earthquake_cells)
         return self._earthquake
 
 class _DirectionTrafficAccidentData():
-    def __init__(self, coordinates):
-        self._coords = []
-        for coordinate in coordinates:
-            self._coords.append(Coordinate(coordinate))
+    def __init__(self, cells):
+        self._cells = cells if cells is not None else []
         self._data = None
-        self._number = None
-        self._total_fatality = None
-        self._total_injury = None
-        self._pedestrian_fatality = None
-        self._pedestrian_injury = None
+        self._aggregate = None
 
     @property
     def data(self):
         if self._data is None:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future_to_coord = {executor.submit(self._get_traffic_data, coord): coord for coord in self._coords}
-                self._data = []
-                for future in concurrent.futures.as_completed(future_to_coord):
-                    data = future.result()
-                    if data:
-                        self._data.append(data)
+            self._data = traffic_accident_rows(self._cells)
         return self._data
 
-    def _get_traffic_data(self, coord):
-        return coord.traffic_accident.data
+    @property
+    def aggregate(self):
+        if self._aggregate is None:
+            if USE_TRAFFIC_ACCIDENT_INDEX:
+                self._aggregate = traffic_accident_index().aggregate(self._cells)
+            else:
+                self._aggregate = tuple(sum(data[i] for data in self.data) for i in range(3, 8))
+        return self._aggregate
 
     @property
     def number(self):
-        if self._number is None:
-            if not self.data:
-                return 0
-            else:
-                self._number = 0
-                for data in self.data:
-                    self._number += data[3]
-        return self._number
+        return self.aggregate[0]
 
     @property
     def total_fatality(self):
-        if self._total_fatality is None:
-            if not self.data:
-                return 0
-            else:
-                self._total_fatality = 0
-                for data in self.data:
-                    self._total_fatality += data[4]
-        return self._total_fatality
+        return self.aggregate[1]
 
     @property
     def total_injury(self):
-        if self._total_injury is None:
-            if not self.data:
-                return 0
-            else:
-                self._total_injury = 0
-                for data in self.data:
-                    self._total_injury += data[5]
-        return self._total_injury
+        return self.aggregate[2]
 
     @property
     def pedestrian_fatality(self):
-        if self._pedestrian_fatality is None:
-            if not self.data:
-                return None
-            else:
-                self._pedestrian_fatality = 0
-                for data in self.data:
-                    self._pedestrian_fatality += data[6]
-        return self._pedestrian_fatality
+        if not self.number:
+            return None
+        return self.aggregate[3]
 
     @property
     def pedestrian_injury(self):
-        if self._pedestrian_injury is None:
-            if not self.data:
-                return None
-            else:
-                self._pedestrian_injury = 0
-                for data in self.data:
-                    self._pedestrian_injury += data[7]
-        return self._pedestrian_injury
+        if not self.number:
+            return None
+        return self.aggregate[4]
 
 class _DirectionEarthquakeData():
-    def __init__(self, coordinates):
-        self._coords = []
-        for coordinate in coordinates:
-            self._coords.append(Coordinate(coordinate))
+    def __init__(self, cells):
+        self._cells = cells if cells is not None else []
         self._data = None
         self._number = None
         self._date = None
@@ -279,22 +301,14 @@ class _DirectionEarthquakeData():
     @property
     def data(self):
         if self._data is None:
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future_to_coord = {executor.submit(self._get_earthquake_data, coord): coord for coord in self._coords}
-                data = []
-                for future in concurrent.futures.as_completed(future_to_coord):
-                    elements = future.result()
-                    if elements:
-                        data.extend(elements)
+            data = earthquake_rows(self._cells)
             if len(data) == 0:
                 return None
             else:
-                self._data = list(set(data))
+                # Each event is one row of 'risk_earthquake' in one cell
+                self._data = data
         return self._data
 
-    def _get_earthquake_data(self, coord):
-        return coord.earthquake.data
-
     @property
     def number(self):
         if self._number is None:
@@ -400,6 +414,192 @@ class _DirectionEarthquakeData():
         return self._avg_depth
 
 
+class RouteRisk():
+    """The running risk totals of a route, which are added up chunk by chunk
+        by 'route_risks' or 'aroute_risks'.
+
+    Each earthquake event is one row of 'risk_earthquake' in one cell, and
+    the chunks of a route never share a cell, so every event is counted once
+    in the order in which the route passes its epicenter.
+    """
+    def __init__(self):
+        self.traffic_accident_number = 0
+        self.traffic_accident_fatality = 0
+        self.traffic_accident_injury = 0
+        self.traffic_accident_pedestrian_fatality = 0
+        self.traffic_accident_pedestrian_injury = 0
+        self._earthquakes = []
+        # Running sums of the averages, see 'risk.average_magnitude'
+        self._magnitude_sum = 0
+        self._depth_sum = 0
+        # The number of earthquakes already written by 'progress_dict'
+        self._reported = 0
+        self.done = False
+
+    def add_traffic_accident(self, aggregate):
+        """:param aggregate: see '_DirectionTrafficAccidentData.aggregate'
+        :type aggregate: tuple"""
+
+        self.traffic_accident_number += aggregate[0]
+        self.traffic_accident_fatality += aggregate[1]
+        self.traffic_accident_injury += aggregate[2]
+        self.traffic_accident_pedestrian_fatality += aggregate[3]
+        self.traffic_accident_pedestrian_injury += aggregate[4]
+
+    def add_earthquakes(self, rows):
+        """:param rows: rows of 'risk_earthquake', see 'earthquake_rows'
+        :type rows: list of tuples"""
+
+        self._earthquakes.extend(rows)
+        for data in rows:
+            self._magnitude_sum += 10 ** data[5]
+            self._depth_sum += data[6]
+
+    @property
+    def earthquakes(self):
+        return list(self._earthquakes)
+
+    @property
+    def earthquake_number(self):
+        return len(self._earthquakes)
+
+    @property
+    def earthquake_average_magnitude(self):
+        if not self._earthquakes:
+            return None
+        return math.log10(self._magnitude_sum / len(self._earthquakes))
+
+    @property
+    def earthquake_average_depth(self):
+        if not self._earthquakes:
+            return None
+        return self._depth_sum / len(self._earthquakes)
+
+    def to_dict(self, depth_format=".2f", start=0):
+        """This method is used to get the JSON response of the route views.
+
+        :param depth_format: The format of the average depth, since 'map' and
+            'travel_map' round it differently.
+        :type depth_format: str
+
+        :param start: The index of the first earthquake in 'earthquake_data',
+            see 'progress_dict'.
+        :type start: int
+
+        :rtype: dict"""
+
+        if self._earthquakes:
+            earthquake_average_magnitude = f"{self.earthquake_average_magnitude:.2f}"
+            earthquake_average_depth = f"{self.earthquake_average_depth:{depth_format}}"
+        else:
+            earthquake_average_magnitude = None
+            earthquake_average_depth = None
+        return {
+            "traffic_accident_number": self.traffic_accident_number,
+            "traffic_accident_fatality": self.traffic_accident_fatality,
+            "traffic_accident_injury": self.traffic_accident_injury,
+            "earthquake_number": self.earthquake_number,
+            "earthquake_average_magnitude": earthquake_average_magnitude,
+            "earthquake_average_depth": earthquake_average_depth,
+            "earthquake_data": [{
+                "date": data[1],
+                "coordinate": (data[3], data[4]),
+                "magnitude": data[5],
+                "depth": data[6],
+            } for data in self._earthquakes[start:]]
+        }
+
+    def progress_dict(self, depth_format=".2f"):
+        """This method is used to get a line of a streamed response, with the
+            running totals but only the earthquakes added since the last line
+            in 'earthquake_data'. The last line of a stream is 'to_dict'
+            with every earthquake.
+
+        :rtype: dict"""
+
+        data = self.to_dict(depth_format, start=self._reported)
+        self._reported = len(self._earthquakes)
+        return data
+
+def _traffic_accident_aggregate(cells):
+    return _DirectionTrafficAccidentData(cells).aggregate
+
+def _route_chunks(traffic_accident_cells, earthquake_cells, loading_number):
+    traffic_accident_cells = traffic_accident_cells if traffic_accident_cells is not None else []
+    earthquake_cells = earthquake_cells if earthquake_cells is not None else []
+    chunk_number = max(len(traffic_accident_cells), len(earthquake_cells), 1)
+    return [(traffic_accident_cells[loading_index: loading_index + loading_number],
+             earthquake_cells[loading_index: loading_index + loading_number])
+            for loading_index in range(0, chunk_number, loading_number)]
+
+def route_risks(traffic_accident_cells, earthquake_cells, loading_number=RISK_LOADING_NUMBER,
+                executor=RISK_EXECUTOR):
+    """Get the risks of a route chunk by chunk.
+
+    The traffic accident and earthquake lookups of a chunk run concurrently
+    in 'executor', and the lookups of the next chunk are submitted before
+    the results of the current chunk are added up. Do not iterate this in a
+    thread of 'executor' itself, use 'aroute_risks' in async code instead.
+
+    :param traffic_accident_cells: Keys of 0.0001 degree grid cells, e.g.
+        'Direction.traffic_accident_cells'.
+    :type traffic_accident_cells: numpy.ndarray
+
+    :param earthquake_cells: Keys of 0.01 degree grid cells.
+    :type earthquake_cells: numpy.ndarray
+
+    :param loading_number: The number of cells looked up at a time.
+    :type loading_number: int
+
+    :return: The same 'RouteRisk' after each chunk, with 'done' set after
+        the last one.
+    :rtype: generator of RouteRisk
+    """
+    def submit(chunk):
+        traffic_accident_chunk, earthquake_chunk = chunk
+        return (executor.submit("traffic_accident", _traffic_accident_aggregate, traffic_accident_chunk),
+                executor.submit("earthquake", earthquake_rows, earthquake_chunk))
+
+    route_risk = RouteRisk()
+    chunks = _route_chunks(traffic_accident_cells, earthquake_cells, loading_number)
+    pending = submit(chunks[0])
+    for index in range(len(chunks)):
+        traffic_accident_future, earthquake_future = pending
+        if index + 1 < len(chunks):
+            pending = submit(chunks[index + 1])
+        route_risk.add_traffic_accident(traffic_accident_future.result())
+        route_risk.add_earthquakes(earthquake_future.result())
+        route_risk.done = index + 1 == len(chunks)
+        yield route_risk
+
+async def aroute_risks(traffic_accident_cells, earthquake_cells, loading_number=RISK_LOADING_NUMBER):
+    """This method is the async version of 'route_risks', whose lookups run
+        in 'RISK_EXECUTOR'."""
+
+    def submit(chunk):
+        traffic_accident_chunk, earthquake_chunk = chunk
+        return asyncio.gather(run_in_risk_executor(_traffic_accident_aggregate, traffic_accident_chunk,
+                                                   task_type="traffic_accident"),
+                              run_in_risk_executor(earthquake_rows, earthquake_chunk,
+                                                   task_type="earthquake"))
+
+    route_risk = RouteRisk()
+    chunks = _route_chunks(traffic_accident_cells, earthquake_cells, loading_number)
+    pending = submit(chunks[0])
+    try:
+        for index in range(len(chunks)):
+            future = pending
+            if index + 1 < len(chunks):
+                pending = submit(chunks[index + 1])
+            aggregate, rows = await future
+            route_risk.add_traffic_accident(aggregate)
+            route_risk.add_earthquakes(rows)
+            route_risk.done = index + 1 == len(chunks)
+            yield route_risk
+    finally:
+        pending.cancel()
+
+
 class Geocode():
     def __init__(self, address=None):
         language = "zh-TW"
@@ -509,7 +709,6 @@ class Hotspot():
             self._columns.append(("latitude", self._latitude))
             self._columns.append(("longitude", self._longitude))
 
-        self.controller = AttractionSQLController()
         self.data = []
         self.id = []
         self.name = []
@@ -524,7 +723,13 @@ class Hotspot():
         self._get_data()
 
     def _get_data(self):
-        self.data = self.controller.get_data_from_columns(self._columns)
+        # Closed right away, so that the connection of the thread is reset
+        # once its last controller is released
+        controller = AttractionSQLController()
+        try:
+            self.data = controller.get_data_from_columns(self._columns) or []
+        finally:
+            controller.close()
 
         for data in self.data:
             self.id.append(data[0])
@@ -565,7 +770,6 @@ class Foodspot():
             self._avg_price = avg_price
             self._columns.append(("avg_price", self._avg_price))
 
-        self.controller = RestaurantSQLController()
         self.data = []
         self.id = []
         self.name = []
@@ -584,7 +788,11 @@ class Foodspot():
         self._get_data()
 
     def _get_data(self):
-        self.data = self.controller.get_data_from_columns(self._columns)
+        controller = RestaurantSQLController()
+        try:
+            self.data = controller.get_data_from_columns(self._columns) or []
+        finally:
+            controller.close()
 
         for data in self.data:
             self.id.append(data[0])
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+from explorer import grid
+
+
+def populate_cells(apps, schema_editor):
+    TrafficAccident = apps.get_model("explorer", "TrafficAccident")
+    Earthquake = apps.get_model("explorer", "Earthquake")
+    for model, difference in ((TrafficAccident, grid.TRAFFIC_ACCIDENT_DIFFERENCE),
+                              (Earthquake, grid.EARTHQUAKE_DIFFERENCE)):
+        rows = []
+        for row in model.objects.only("latitude", "longitude").iterator():
+            row.cell = grid.cell(float(row.latitude), float(row.longitude), difference)
+            rows.append(row)
+        model.objects.bulk_update(rows, ["cell"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("explorer", "0003_restaurant"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="earthquake",
+            name="cell",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="trafficaccident",
+            name="cell",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunPython(populate_cells, migrations.RunPython.noop),
+    ]
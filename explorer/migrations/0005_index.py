@@ -0,0 +1,79 @@
+# Generated by Django 5.0.5 on 2026-10-18 15:40
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+COUNT_COLUMNS = ["number", "total_fatality", "total_injury",
+                 "pedestrian_fatality", "pedestrian_injury"]
+
+
+def merge_duplicates(apps, schema_editor):
+    # Rows of the same key are added up into the first one, so that the
+    # unique constraints below can be created
+    for model_name, fields in (("TrafficAccident", ["cell"]),
+                               ("PedestrianHell", ["area_1", "area_2"])):
+        model = apps.get_model("explorer", model_name)
+        duplicates = (model.objects.exclude(**{f"{fields[0]}__isnull": True})
+                      .values(*fields)
+                      .annotate(count=Count("id"), first_id=Min("id"),
+                                **{f"sum_{column}": Sum(column) for column in COUNT_COLUMNS})
+                      .filter(count__gt=1))
+        for duplicate in duplicates:
+            model.objects.filter(id=duplicate["first_id"]).update(
+                **{column: duplicate[f"sum_{column}"] for column in COUNT_COLUMNS})
+            (model.objects.filter(**{field: duplicate[field] for field in fields})
+             .exclude(id=duplicate["first_id"]).delete())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("explorer", "0004_cell"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="earthquake",
+            index=models.Index(fields=["cell"], name="earthquake_cell_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="earthquake",
+            index=models.Index(fields=["latitude", "longitude"], name="earthquake_coordinate_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="earthquakeintensity",
+            index=models.Index(fields=["area"], name="earthquake_intensity_area_idx"),
+        ),
+        migrations.AddConstraint(
+            model_name="trafficaccident",
+            constraint=models.UniqueConstraint(fields=("cell",), name="traffic_accident_cell_unique"),
+        ),
+        migrations.AddConstraint(
+            model_name="trafficaccident",
+            constraint=models.UniqueConstraint(fields=("latitude", "longitude"),
+                                               name="traffic_accident_coordinate_unique"),
+        ),
+        migrations.AddConstraint(
+            model_name="pedestrianhell",
+            constraint=models.UniqueConstraint(fields=("area_1", "area_2"), name="pedestrian_hell_area_unique"),
+        ),
+        migrations.AddIndex(
+            model_name="hotspot",
+            index=models.Index(fields=["latitude", "longitude"], name="hotspot_coordinate_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="hotspot",
+            index=models.Index(fields=["area_1", "area_2"], name="hotspot_area_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="restaurant",
+            index=models.Index(fields=["latitude", "longitude"], name="restaurant_coordinate_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="restaurant",
+            index=models.Index(fields=["area_1", "area_2"], name="restaurant_area_idx"),
+        ),
+        # Let the query planner know the new indexes and the table sizes
+        migrations.RunSQL("ANALYZE", migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.0.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import Min
+
+from explorer import risk
+
+
+def populate_pga_sums(apps, schema_editor):
+    # Rows of the same area are added up into the first one, so that the
+    # unique constraint below can be created
+    EarthquakeIntensity = apps.get_model("explorer", "EarthquakeIntensity")
+    sums = {}
+    for row in EarthquakeIntensity.objects.order_by("id").iterator():
+        pga_sum = float(row.pga) * row.number
+        if row.area in sums:
+            first = sums[row.area]
+            first.number += row.number
+            first.pga_sum += pga_sum
+            row.delete()
+        else:
+            row.pga_sum = pga_sum
+            sums[row.area] = row
+    EarthquakeIntensity.objects.bulk_update(sums.values(), ["number", "pga_sum"], batch_size=1000)
+
+def populate_averages(apps, schema_editor):
+    EarthquakeIntensity = apps.get_model("explorer", "EarthquakeIntensity")
+    rows = []
+    for row in EarthquakeIntensity.objects.iterator():
+        row.pga = row.pga_sum / row.number if row.number else 0
+        row.intensity = risk.pga_to_intensity(row.pga)
+        rows.append(row)
+    EarthquakeIntensity.objects.bulk_update(rows, ["pga", "intensity"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("explorer", "0005_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="earthquakeintensity",
+            name="pga_sum",
+            field=models.FloatField(default=0),
+        ),
+        # The averages are nullable while they are removed, so that they can
+        # be added back and populated when the migration is reversed
+        migrations.AlterField(
+            model_name="earthquakeintensity",
+            name="intensity",
+            field=models.TextField(max_length=3, null=True),
+        ),
+        migrations.AlterField(
+            model_name="earthquakeintensity",
+            name="pga",
+            field=models.DecimalField(max_digits=8, decimal_places=5, null=True),
+        ),
+        migrations.RunPython(populate_pga_sums, populate_averages),
+        migrations.RemoveIndex(
+            model_name="earthquakeintensity",
+            name="earthquake_intensity_area_idx",
+        ),
+        migrations.AddConstraint(
+            model_name="earthquakeintensity",
+            constraint=models.UniqueConstraint(fields=("area",), name="earthquake_intensity_area_unique"),
+        ),
+        migrations.RemoveField(
+            model_name="earthquakeintensity",
+            name="intensity",
+        ),
+        migrations.RemoveField(
+            model_name="earthquakeintensity",
+            name="pga",
+        ),
+    ]
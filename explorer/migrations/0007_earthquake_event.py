@@ -0,0 +1,63 @@
+# Generated by Django 5.0.5 on 2026-10-18 20:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from explorer import risk
+
+
+def populate_keys(apps, schema_editor):
+    # Rows of the same event are taken out except the first one, so that the
+    # unique constraint below can be created
+    Earthquake = apps.get_model("explorer", "Earthquake")
+    rows = []
+    duplicates = []
+    keys = set()
+    for row in Earthquake.objects.order_by("id").iterator():
+        row.key = risk.earthquake_key(row.date.isoformat(), row.time.isoformat(),
+                                      row.latitude, row.longitude)
+        if row.key in keys:
+            duplicates.append(row.id)
+        else:
+            keys.add(row.key)
+            rows.append(row)
+    for index in range(0, len(duplicates), 900):
+        Earthquake.objects.filter(id__in=duplicates[index: index + 900]).delete()
+    Earthquake.objects.bulk_update(rows, ["key"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("explorer", "0006_earthquake_intensity_sum"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="earthquake",
+            name="key",
+            field=models.CharField(max_length=40, null=True),
+        ),
+        migrations.RunPython(populate_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="earthquake",
+            name="key",
+            field=models.CharField(max_length=40, unique=True),
+        ),
+        migrations.CreateModel(
+            name="EarthquakeAreaIntensity",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("area", models.TextField(max_length=5)),
+                ("intensity", models.TextField(max_length=3)),
+                ("pga", models.FloatField()),
+                ("event", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                            related_name="intensities", to="explorer.earthquake")),
+            ],
+            options={
+                "db_table": "risk_earthquake_area_intensity",
+                "constraints": [
+                    models.UniqueConstraint(fields=("event", "area"), name="earthquake_area_intensity_unique"),
+                ],
+            },
+        ),
+    ]
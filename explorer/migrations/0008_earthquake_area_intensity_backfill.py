@@ -0,0 +1,65 @@
+# Generated by Django 5.0.5 on 2026-10-18 22:10
+
+import logging
+import os
+
+import pandas as pd
+from django.db import migrations
+
+from explorer import risk
+
+
+logger = logging.getLogger(__name__)
+
+EARTHQUAKE_CSV_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  "data", "earthquakes")
+CSV_DTYPES = {"Date": str, "Time": str, "北緯": float, "東經": float, "城市": str, "震度": str}
+
+
+def backfill_area_intensities(apps, schema_editor):
+    # The events ingested before 0007 have no area rows, although their
+    # intensities are already added up in 'risk_earthquake_intensity'. Their
+    # rows are read from the csv files again without adding them up, so that
+    # ingesting the same months again does not count them twice.
+    Earthquake = apps.get_model("explorer", "Earthquake")
+    EarthquakeAreaIntensity = apps.get_model("explorer", "EarthquakeAreaIntensity")
+    events = dict(Earthquake.objects.filter(intensities__isnull=True).values_list("key", "id"))
+    rows = []
+    missing_years = []
+    for year in sorted({int(key[:4]) for key in events}):
+        path = os.path.join(EARTHQUAKE_CSV_DIR, f"earthquake_{year}年.csv")
+        if not os.path.exists(path):
+            missing_years.append(year)
+            continue
+        df = pd.read_csv(path, encoding="big5", dtype=CSV_DTYPES, usecols=list(CSV_DTYPES))
+        # The same formats as 'EarthquakeSQLController.bulk_new' gets
+        dates = pd.to_datetime(df["Date"], format="%Y-%m-%d").dt.strftime("%Y-%m-%d")
+        times = pd.to_datetime(df["Time"], format="%H:%M:%S").dt.strftime("%H:%M:%S")
+        # see 'explorer.database.normalize_intensities'
+        intensities = (df["震度"].str.replace(" ", "", regex=False)
+                       .where(df["震度"].str.len() != 1, df["震度"] + "級"))
+        pgas = {intensity: risk.intensity_to_pga(intensity) for intensity in intensities.unique()}
+        added = set()
+        for date, time, latitude, longitude, area, intensity in zip(
+                dates, times, df["北緯"], df["東經"], df["城市"], intensities):
+            event_id = events.get(risk.earthquake_key(date, time, latitude, longitude))
+            if event_id is None or (event_id, area) in added:
+                continue
+            added.add((event_id, area))
+            rows.append(EarthquakeAreaIntensity(event_id=event_id, area=area, intensity=intensity,
+                                                pga=pgas[intensity]))
+    EarthquakeAreaIntensity.objects.bulk_create(rows, batch_size=1000)
+    if missing_years:
+        # Ingesting these years again would add their intensities up twice,
+        # so empty 'risk_earthquake_intensity' and ingest every year instead
+        logger.warning("No csv files to backfill the area intensities of %s", missing_years)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("explorer", "0007_earthquake_event"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_area_intensities, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,7 @@
 from django.db import models
 
+from explorer import risk
+
 
 class Earthquake(models.Model):
     date = models.DateField()
@@ -8,21 +10,59 @@ class Earthquake(models.Model):
     longitude = models.DecimalField(max_digits=8, decimal_places=5)
     magnitude = models.DecimalField(max_digits=5, decimal_places=2)
     depth = models.DecimalField(max_digits=5, decimal_places=2)
+    # Key of the 0.01 degree grid cell of the epicenter, see 'explorer.grid'
+    cell = models.BigIntegerField(null=True)
+    # One row per event, see 'risk.earthquake_key'
+    key = models.CharField(max_length=40, unique=True)
 
     class Meta:
         db_table = "risk_earthquake"
+        indexes = [
+            models.Index(fields=["cell"], name="earthquake_cell_idx"),
+            models.Index(fields=["latitude", "longitude"], name="earthquake_coordinate_idx"),
+        ]
 
     def __str__(self):
         return f"{self.date} {self.time} - Magnitude: {self.magnitude} in ({self.latitude}, {self.longitude})"
 
+class EarthquakeAreaIntensity(models.Model):
+    """The intensity of an earthquake event in one of the areas where it was
+        felt."""
+
+    event = models.ForeignKey(Earthquake, on_delete=models.CASCADE, related_name="intensities")
+    area = models.TextField(max_length=5)
+    intensity = models.TextField(max_length=3)
+    pga = models.FloatField()
+
+    class Meta:
+        db_table = "risk_earthquake_area_intensity"
+        constraints = [
+            models.UniqueConstraint(fields=["event", "area"], name="earthquake_area_intensity_unique"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} - {self.area}: {self.intensity}"
+
 class EarthquakeIntensity(models.Model):
     area = models.TextField(max_length=5)
     number = models.IntegerField()
-    intensity = models.TextField(max_length=3)
-    pga = models.DecimalField(max_digits=8, decimal_places=5)
+    # The sum of the PGA of every record of the area, so that records are
+    # added without reading the row. The averages are derived on read.
+    pga_sum = models.FloatField(default=0)
 
     class Meta:
         db_table = "risk_earthquake_intensity"
+        constraints = [
+            models.UniqueConstraint(fields=["area"], name="earthquake_intensity_area_unique"),
+        ]
+
+    @property
+    def pga(self):
+        return self.pga_sum / self.number if self.number else None
+
+    @property
+    def intensity(self):
+        return risk.pga_to_intensity(self.pga) if self.number else None
 
     def __str__(self):
         return f"{self.area} - Average Intensity: {self.intensity}"
@@ -35,9 +75,16 @@ class TrafficAccident(models.Model):
     total_injury = models.IntegerField()
     pedestrian_fatality = models.IntegerField()
     pedestrian_injury = models.IntegerField()
+    # Key of the 0.0001 degree grid cell, see 'explorer.grid'
+    cell = models.BigIntegerField(null=True)
 
     class Meta:
         db_table = "risk_traffic_accident"
+        # Traffic accidents are aggregated per grid cell
+        constraints = [
+            models.UniqueConstraint(fields=["cell"], name="traffic_accident_cell_unique"),
+            models.UniqueConstraint(fields=["latitude", "longitude"], name="traffic_accident_coordinate_unique"),
+        ]
 
     def __str__(self):
         return f"""Traffic Accident in ({self.latitude}, {self.longitude}) -
@@ -55,6 +102,10 @@ class PedestrianHell(models.Model):
 
     class Meta:
         db_table = "risk_pedestrian_hell"
+        # Pedestrian accidents are aggregated per administrative area
+        constraints = [
+            models.UniqueConstraint(fields=["area_1", "area_2"], name="pedestrian_hell_area_unique"),
+        ]
 
     def __str__(self):
         return f"""{self.area_1} {self.area_2} -
@@ -72,6 +123,10 @@ class Hotspot(models.Model):
 
     class Meta:
         db_table = "map_hotspot"
+        indexes = [
+            models.Index(fields=["latitude", "longitude"], name="hotspot_coordinate_idx"),
+            models.Index(fields=["area_1", "area_2"], name="hotspot_area_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.latitude}, {self.longitude}) {self.address}"
@@ -91,6 +146,10 @@ class Restaurant(models.Model):
 
     class Meta:
         db_table = "map_restaurant"
+        indexes = [
+            models.Index(fields=["latitude", "longitude"], name="restaurant_coordinate_idx"),
+            models.Index(fields=["area_1", "area_2"], name="restaurant_area_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.latitude}, {self.longitude}) {self.address}"
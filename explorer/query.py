@@ -0,0 +1,144 @@
+"""
+This module is used to build the SQL statements of the SQLController family
+
+Every statement is parameterized, so values never become part of the SQL
+text. The texts are built once and cached, and the lists of an 'IN' clause
+are padded to a few fixed lengths, so the controllers only ever run a small
+fixed set of statements, which sqlite3 prepares once per connection and
+reuses from its statement cache.
+
+Table and column names can not be parameters. They are checked against the
+typed columns of each table, see 'SQLController.COLUMNS'.
+"""
+from functools import lru_cache
+
+__all__ = ["InvalidColumnError", "check_columns", "check_value", "in_size", "pad",
+           "select", "select_in", "insert", "update", "update_add", "upsert_add", "insert_ignore"]
+
+
+# SQLite allows 999 bound variables per statement
+IN_SIZES = (1, 4, 16, 64, 256, 900)
+
+
+class InvalidColumnError(Exception):
+    def __init__(self, table_name, column):
+        super().__init__(f"'{column}' is not a column of '{table_name}'")
+
+def check_columns(table_name, columns, names):
+    """This method is used to check column names against a whitelist.
+
+    :param columns: The typed columns of the table, e.g. {"id": int}.
+    :type columns: dict
+
+    :param names: Column names, either a list or a comma separated string.
+    :type names: list or str
+
+    :rtype: tuple of str"""
+
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",")]
+    for name in names:
+        if name not in columns:
+            raise InvalidColumnError(table_name, name)
+    return tuple(names)
+
+def check_value(table_name, columns, name, value):
+    """This method is used to convert a value to the type of its column.
+
+    :raises ValueError: if the value can not be converted"""
+
+    check_columns(table_name, columns, [name])
+    if value is None:
+        return None
+    return columns[name](value)
+
+def in_size(number):
+    """This method is used to get the padded length of an 'IN' list of
+        'number' values, which must not exceed the last of 'IN_SIZES'."""
+
+    for size in IN_SIZES:
+        if number <= size:
+            return size
+    raise ValueError(f"At most {IN_SIZES[-1]} values are allowed in an 'IN' clause")
+
+def pad(values):
+    """This method is used to pad an 'IN' list with its last value, which
+        matches no more rows than the list itself."""
+
+    values = list(values)
+    return values + values[-1:] * (in_size(len(values)) - len(values))
+
+@lru_cache(maxsize=None)
+def select(table_name, columns=("*",), where=(), order_by=None, descending=False):
+    """e.g. select("map_hotspot", where=("area_1", "area_2")) is
+        SELECT * FROM map_hotspot WHERE area_1 = ? AND area_2 = ?"""
+
+    sql = f"SELECT {', '.join(columns)} FROM {table_name}"
+    if where:
+        sql += " WHERE " + " AND ".join(f"{name} = ?" for name in where)
+    if order_by:
+        sql += f" ORDER BY {order_by}" + (" DESC" if descending else "")
+    return sql
+
+@lru_cache(maxsize=None)
+def select_in(table_name, columns, column, size):
+    """e.g. select_in("risk_earthquake", ("*",), "cell", 4) is
+        SELECT * FROM risk_earthquake WHERE cell IN (?, ?, ?, ?)"""
+
+    return f"SELECT {', '.join(columns)} FROM {table_name} WHERE {column} IN ({', '.join(['?'] * size)})"
+
+@lru_cache(maxsize=None)
+def insert(table_name, columns):
+    return (f"INSERT INTO {table_name} ({', '.join(columns)}) "
+            f"VALUES ({', '.join(['?'] * len(columns))})")
+
+@lru_cache(maxsize=None)
+def update(table_name, columns):
+    """e.g. update("map_hotspot", ("name", "image")) is
+        UPDATE map_hotspot SET name = ?, image = ? WHERE id = ?"""
+
+    return f"UPDATE {table_name} SET {', '.join(f'{name} = ?' for name in columns)} WHERE id = ?"
+
+@lru_cache(maxsize=None)
+def update_add(table_name, columns):
+    """e.g. update_add("risk_pedestrian_hell", ("number",)) is
+        UPDATE risk_pedestrian_hell SET number = number + ? WHERE id = ?"""
+
+    return f"UPDATE {table_name} SET {', '.join(f'{name} = {name} + ?' for name in columns)} WHERE id = ?"
+
+@lru_cache(maxsize=None)
+def upsert_add(table_name, keys, columns, conflict=None):
+    """e.g. upsert_add("risk_pedestrian_hell", ("area_1", "area_2"), ("number",)) is
+        INSERT INTO risk_pedestrian_hell (area_1, area_2, number) VALUES (?, ?, ?)
+        ON CONFLICT (area_1, area_2) DO UPDATE SET number = number + excluded.number
+
+    The conflict columns, by default the keys, must be a unique constraint of
+    the table."""
+
+    return (insert(table_name, keys + columns) +
+            f" ON CONFLICT ({', '.join(conflict or keys)}) DO UPDATE SET " +
+            ", ".join(f"{name} = {name} + excluded.{name}" for name in columns))
+
+@lru_cache(maxsize=None)
+def insert_ignore(table_name, columns, conflict):
+    """e.g. insert_ignore("risk_earthquake", ("key", "date"), ("key",)) is
+        INSERT INTO risk_earthquake (key, date) VALUES (?, ?)
+        ON CONFLICT (key) DO NOTHING"""
+
+    return insert(table_name, columns) + f" ON CONFLICT ({', '.join(conflict)}) DO NOTHING"
+
+
+def test_query():
+    print(select("map_hotspot", where=("area_1", "area_2")))
+    print(select("risk_traffic_accident", order_by="number", descending=True))
+    print(select_in("risk_earthquake", ("*",), "cell", in_size(3)), pad([1, 2, 3]))
+    print(update_add("risk_pedestrian_hell", ("number", "total_injury")))
+    print(upsert_add("risk_pedestrian_hell", ("area_1", "area_2"), ("number", "total_injury")))
+    try:
+        check_columns("map_hotspot", {"id": int}, "id, name; DROP TABLE map_hotspot")
+    except InvalidColumnError as e:
+        print(e)
+
+if __name__ == "__main__":
+    # test_query()
+    pass
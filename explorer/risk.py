@@ -93,6 +93,20 @@ def average_depth(depths):
     else:
         return None
 
+def earthquake_key(date, time, latitude, longitude):
+    """This method is used to get the stable key of an earthquake event, which
+        is the same for every felt area of the event in the csv files.
+
+    e.g. earthquake_key("1999-09-21", "01:47:15", 23.85, 120.82) is
+        "1999-09-21T01:47:15/23.85/120.82"
+
+    :param date: The date, e.g. a datetime.date or "1999-09-21".
+    :param time: The time, e.g. a datetime.time or "01:47:15".
+
+    :rtype: str"""
+
+    return f"{date}T{time}/{float(latitude):.2f}/{float(longitude):.2f}"
+
 
 def test_intensity():
     # intensity = "5級"
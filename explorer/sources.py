@@ -0,0 +1,193 @@
+"""
+This module is used to read the source csv files through a columnar cache
+
+The first read of a csv file parses it as usual and saves the typed frame to
+a Feather file. Later reads load the saved frame instead of parsing the csv
+file again. Without pyarrow the cache is off and every read parses the csv
+file, since the other formats pandas offers, e.g. pickle, can run code when
+a file of the cache directory is loaded.
+
+A saved frame is used only while its source file has the same size and
+modification time as when it was saved. When only the modification time
+changed, e.g. after a checkout, the content hash of the source decides. The
+cache directory is not tracked by git.
+"""
+import hashlib
+import json
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+__all__ = ["read_csv", "read_csv_chunks", "load_frame", "save_frame", "frame_path", "clear", "stats"]
+
+
+# Set 'USE_SOURCE_CACHE=0' to always parse the csv files
+USE_SOURCE_CACHE = os.getenv("USE_SOURCE_CACHE", "1") == "1" and feather is not None
+SOURCE_CACHE_DIR = os.getenv("SOURCE_CACHE_DIR",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cache"))
+# Increase to drop every saved frame, e.g. when the saved format changes
+SOURCE_CACHE_VERSION = 1
+
+_HASH_CHUNK_SIZE = 1 << 20
+_stats = {"hits": 0, "misses": 0, "rehashed": 0}
+
+
+def _file_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cache_path(path, kwargs):
+    # The same file read with other arguments is another entry
+    key = json.dumps([SOURCE_CACHE_VERSION, pd.__version__, os.path.abspath(path),
+                      sorted((name, repr(value)) for name, value in kwargs.items())])
+    name = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return frame_path(name)
+
+def _load_metadata(path):
+    try:
+        with open(f"{path}.json") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _save_metadata(path, metadata):
+    temporary_path = f"{path}.json.tmp"
+    with open(temporary_path, "w") as file:
+        json.dump(metadata, file)
+    os.replace(temporary_path, f"{path}.json")
+
+def _is_fresh(source, path, metadata):
+    """This method is used to check a saved frame against its source file,
+        and to update the saved modification time when only the modification
+        time has changed."""
+
+    if metadata is None or not os.path.exists(path):
+        return False
+    status = os.stat(source)
+    if status.st_size != metadata["size"]:
+        return False
+    if status.st_mtime_ns == metadata["mtime_ns"]:
+        return True
+    _stats["rehashed"] += 1
+    if _file_hash(source) != metadata["hash"]:
+        return False
+    metadata["mtime_ns"] = status.st_mtime_ns
+    _save_metadata(path, metadata)
+    return True
+
+def frame_path(name):
+    """This method is used to get the path of a saved frame in the cache
+        directory."""
+
+    return os.path.join(SOURCE_CACHE_DIR, f"{name}.feather")
+
+def load_frame(path):
+    return feather.read_feather(path)
+
+def save_frame(df, path):
+    """This method is used to save a frame with a default index, which
+        Feather requires."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.tmp"
+    feather.write_feather(df, temporary_path)
+    os.replace(temporary_path, path)
+
+def read_csv(path, **kwargs):
+    """This method is used instead of 'pandas.read_csv' to read a source csv
+        file through the cache.
+
+    :param path: The path of the csv file.
+    :type path: str
+
+    :param **kwargs: The arguments of 'pandas.read_csv'.
+
+    :rtype: pandas.DataFrame"""
+
+    if not USE_SOURCE_CACHE:
+        return pd.read_csv(path, **kwargs)
+    cache_path = _cache_path(path, kwargs)
+    metadata = _load_metadata(cache_path)
+    if _is_fresh(path, cache_path, metadata):
+        try:
+            df = load_frame(cache_path)
+            _stats["hits"] += 1
+            return df
+        except Exception:
+            # A damaged entry is parsed and saved again
+            pass
+    _stats["misses"] += 1
+    # The status is taken before parsing, so a file changed meanwhile is
+    # parsed again next time
+    status = os.stat(path)
+    df = pd.read_csv(path, **kwargs)
+    try:
+        save_frame(df, cache_path)
+        _save_metadata(cache_path, {"source": os.path.abspath(path),
+                                    "size": status.st_size,
+                                    "mtime_ns": status.st_mtime_ns,
+                                    "hash": _file_hash(path)})
+    except Exception:
+        # e.g. a read-only file system or a frame Feather can not store,
+        # which only costs parsing the file again
+        pass
+    return df
+
+def read_csv_chunks(path, chunksize, footer=0, **kwargs):
+    """This method is used to read a source csv file in chunks of at most
+        'chunksize' rows, e.g. when the whole file does not fit in memory.
+        The chunks are not cached, since loading a saved frame would read
+        the whole file at once.
+
+    :param footer: The number of rows at the end of the file to drop, which
+        'pandas.read_csv' only supports with the slow python engine.
+    :type footer: int
+
+    :param **kwargs: The arguments of 'pandas.read_csv'.
+
+    :rtype: generator of pandas.DataFrame"""
+
+    tail = None
+    with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+        for df in reader:
+            if footer:
+                # The last rows are held back until the next chunk shows they
+                # are not the footer
+                if tail is not None:
+                    df = pd.concat([tail, df])
+                end = max(len(df) - footer, 0)
+                tail, df = df.iloc[end:], df.iloc[:end]
+            if len(df):
+                yield df
+
+def clear():
+    """This method is used to remove every saved frame."""
+
+    if not os.path.isdir(SOURCE_CACHE_DIR):
+        return
+    for name in os.listdir(SOURCE_CACHE_DIR):
+        os.remove(os.path.join(SOURCE_CACHE_DIR, name))
+
+def stats():
+    return dict(_stats, enabled=USE_SOURCE_CACHE, directory=SOURCE_CACHE_DIR)
+
+
+def test_read_csv():
+    import time
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "restaurants", "Taiwan_food.csv")
+    for _ in range(2):
+        start = time.perf_counter()
+        df = read_csv(path, low_memory=False)
+        print(len(df), f"{time.perf_counter() - start:.3f} s")
+    print(stats())
+
+if __name__ == "__main__":
+    # test_read_csv()
+    pass
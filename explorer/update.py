@@ -16,6 +16,8 @@ def update_traffic_accident_data(count=1):
         round_end_time = time.time()
         round_execution_time = round_end_time - round_start_time
         print(f"{update.number_of_data} records were successfully added to the database!")
+        print(f"{update.number_of_rows} rows were written in {update.execution_time:.2f} seconds "
+              f"({update.rows_per_second or 0:.0f} records/s)")
         print(f"Round Execution Time: {round_execution_time/60:.1f} minutes")
         print("----------------")
     end_time = time.time()
@@ -29,4 +29,5 @@ urlpatterns = [
     url(r'^map/', views.map, name='map'),
     url(r'^travel/', views.travel, name='travel'),
     url(r'^travel_map/', views.travel_map, name='travel_map'),
+    url(r'^risk_stats/', views.risk_stats, name='risk_stats'),
 ]
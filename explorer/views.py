@@ -1,13 +1,20 @@
 from django.contrib import auth
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.mail import send_mail
 from django.db import IntegrityError
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import csrf_exempt
-from explorer.database import AttractionSQLController, RestaurantSQLController, rounding
-from explorer.maps import Direction, DirectionAPI, Hotspot, Foodspot, GOOGLE_MAPS_API_KEY
+from explorer.database import AttractionSQLController, RestaurantSQLController, \
+                              TRAFFIC_ACCIDENT_CELL_CACHE, EARTHQUAKE_CELL_CACHE, \
+                              TRAFFIC_ACCIDENT_CELL_FILTER, EARTHQUAKE_CELL_FILTER, CONNECTION_POOL
+from explorer.cache import SINGLE_FLIGHT_TIMEOUT
+from explorer.executor import ExecutorBusyError
+from explorer.grid import InvalidCoordinateError
+from explorer.maps import BUFFER_M, ROUTE_CACHE, ROUTE_SINGLE_FLIGHT, RISK_EXECUTOR, run_in_risk_executor, route_risks, aroute_risks, Direction, DirectionAPI, Hotspot, Foodspot, GOOGLE_MAPS_API_KEY
 from explorer.models import UserInfo
-from explorer.risk import average_magnitude, average_depth
+import concurrent.futures
 import json
 import random
 import time
@@ -23,17 +30,154 @@ def index(request):
 def home(request):
     return redirect('/explorer/index')
 
-def map(request):
-    def coordinate_set(coordinates, difference):
-        coords = []
-        for coordinate in coordinates:
-            latitude = rounding(coordinate["lat"], difference)
-            longitude = rounding(coordinate["lng"], difference)
-            coords.append((latitude, longitude))
-        return list(set(coords))
+def get_buffer_m(request):
+    """This method is used to get the corridor half width of a route request
+        from its 'travel_mode', e.g. 'DRIVING' or 'WALKING'. Only these
+        presets are accepted, so a request cannot widen its route to more
+        cells than the server allows."""
 
-    RISK_LOADING_NUMBER = 100
+    return BUFFER_M.get(request.POST.get('travel_mode', '').upper(), 0)
 
+def stream_error(exception):
+    """This method is used to get the last line of a route risk stream which
+        failed after its header was sent.
+
+    :rtype: str"""
+
+    if isinstance(exception, (TimeoutError, concurrent.futures.TimeoutError)):
+        error = "The route risk calculation timed out. Please try again later."
+    elif isinstance(exception, ExecutorBusyError):
+        error = "The server is busy. Please try again later."
+    else:
+        error = "An error occurred while calculating the route risk."
+    return json.dumps({"error": error, "done": True}) + "\n"
+
+def stream_map_risk(route_risks, cache_key):
+    """This method is used to write the running totals of a route as newline
+        delimited JSON, with 'done' set on the last line. Each line only has
+        the earthquakes of its chunk, and the last line has every earthquake
+        of the route, see 'RouteRisk.progress_dict'. The risk of the whole
+        route is cached once the last chunk is written. If the calculation
+        fails, the last line only has an 'error', see 'stream_error'.
+
+    Identical routes streamed at the same time are computed once, the other
+    requests only get the last line, or an error after
+    'SINGLE_FLIGHT_TIMEOUT'.
+
+    :param route_risks: the running totals after each chunk, see
+        'explorer.maps.route_risks'
+    :type route_risks: iterable of RouteRisk"""
+
+    future, is_leader = ROUTE_SINGLE_FLIGHT.begin(cache_key)
+    if not is_leader:
+        try:
+            data = future.result(timeout=SINGLE_FLIGHT_TIMEOUT)
+        except Exception as e:
+            yield stream_error(e)
+            return
+        yield json.dumps({**data, "done": True}) + "\n"
+        return
+    finished = False
+    try:
+        for route_risk in route_risks:
+            if not route_risk.done:
+                yield json.dumps({**route_risk.progress_dict(), "done": False}) + "\n"
+                continue
+            data = route_risk.to_dict()
+            ROUTE_CACHE.set(cache_key, data)
+            ROUTE_SINGLE_FLIGHT.finish(cache_key, data)
+            finished = True
+            yield json.dumps({**data, "done": True}) + "\n"
+    except Exception as e:
+        ROUTE_SINGLE_FLIGHT.fail(cache_key, e)
+        finished = True
+        yield stream_error(e)
+    finally:
+        if not finished:
+            ROUTE_SINGLE_FLIGHT.fail(cache_key, RuntimeError(f"The stream of {cache_key} is closed"))
+
+async def astream_map_risk(route_risks, cache_key):
+    """This method is the async version of 'stream_map_risk'."""
+
+    future, is_leader = ROUTE_SINGLE_FLIGHT.begin(cache_key)
+    if not is_leader:
+        try:
+            data = await ROUTE_SINGLE_FLIGHT.wait(future, SINGLE_FLIGHT_TIMEOUT)
+        except Exception as e:
+            yield stream_error(e)
+            return
+        yield json.dumps({**data, "done": True}) + "\n"
+        return
+    finished = False
+    try:
+        async for route_risk in route_risks:
+            if not route_risk.done:
+                yield json.dumps({**route_risk.progress_dict(), "done": False}) + "\n"
+                continue
+            data = route_risk.to_dict()
+            await run_in_risk_executor(ROUTE_CACHE.set, cache_key, data, task_type="route_cache")
+            ROUTE_SINGLE_FLIGHT.finish(cache_key, data)
+            finished = True
+            yield json.dumps({**data, "done": True}) + "\n"
+    except Exception as e:
+        ROUTE_SINGLE_FLIGHT.fail(cache_key, e)
+        finished = True
+        yield stream_error(e)
+    finally:
+        if not finished:
+            ROUTE_SINGLE_FLIGHT.fail(cache_key, RuntimeError(f"The stream of {cache_key} is closed"))
+
+def get_cached_route_risk(traffic_accident_cells, earthquake_cells, view):
+    """This method is used to get the cache key of a route and its cached
+        risk, which is None if the route is not cached.
+
+    :rtype: tuple of str and dict"""
+
+    cache_key = ROUTE_CACHE.key(traffic_accident_cells, earthquake_cells, view=view)
+    return cache_key, ROUTE_CACHE.get(cache_key)
+
+async def get_route_risk(traffic_accident_cells, earthquake_cells, view, depth_format=".2f"):
+    """This method is used to get the risk of a whole route from the route
+        cache, or by adding up all of its chunks.
+
+    :return: the cache key of the route and its risk
+    :rtype: tuple of str and dict"""
+
+    # The data version and the lookups read the database, so they run in
+    # the shared risk executor instead of the event loop
+    cache_key, data = await run_in_risk_executor(get_cached_route_risk, traffic_accident_cells,
+                                                 earthquake_cells, view, task_type="route_cache")
+    if data is None:
+        # Identical routes requested at the same time are computed once
+        data = await ROUTE_SINGLE_FLIGHT.ado(cache_key, compute_route_risk, traffic_accident_cells,
+                                             earthquake_cells, cache_key, depth_format)
+    return cache_key, data
+
+async def compute_route_risk(traffic_accident_cells, earthquake_cells, cache_key, depth_format):
+    async for route_risk in aroute_risks(traffic_accident_cells, earthquake_cells):
+        pass
+    data = route_risk.to_dict(depth_format)
+    await run_in_risk_executor(ROUTE_CACHE.set, cache_key, data, task_type="route_cache")
+    return data
+
+def get_direction(coordinates, buffer_m):
+    """This method is used to get the cells of a route. Walking and buffering
+        a long route is CPU-bound, so the async views run it in the shared
+        risk executor instead of the event loop.
+
+    :rtype: Direction"""
+
+    return Direction(coordinates, buffer_m=buffer_m)
+
+def busy_response(error):
+    print('Error:', str(error))
+    return JsonResponse({'error': 'The server is busy, please try again later'}, status=503)
+
+def is_streaming(request):
+    return (request.POST.get('stream', '') == '1'
+            or 'application/x-ndjson' in request.headers.get('Accept', ''))
+
+async def map(request):
     if request.method == 'POST':
         coordinates = request.POST.get('coordinates', '')
         try:
@@ -41,74 +185,41 @@ def map(request):
                 raise ValueError('No coordinates provided')
             coordinates = json.loads(coordinates)
             # print('Parsed coordinates:', coordinates)
-        except (json.JSONDecodeError, ValueError) as e:
+            direction = await run_in_risk_executor(get_direction, coordinates, get_buffer_m(request),
+                                                   task_type="route_cells")
+        except ExecutorBusyError as e:
+            return busy_response(e)
+        except (json.JSONDecodeError, ValueError, KeyError, TypeError, InvalidCoordinateError) as e:
             print('Error:', str(e))
             # return JsonResponse({'error': 'Invalid coordinates format or no coordinates provided'}, status=400)
             return redirect('/explorer/index')
 
-        traffic_accident_coordinates_set = coordinate_set(coordinates, 0.0001)
-        earthquake_coordinates_set = coordinate_set(coordinates, 0.01)
-
-        # Initialize risk counts
-        traffic_accident_number = 0
-        traffic_accident_fatality = 0
-        traffic_accident_injury = 0
-        earthquake_number = 0
-        earthquake_magnitudes = []
-        earthquake_depths = []
-        earthquake_data = []
-        earthquake_flag = True
-
-        for loading_index in range(0, len(traffic_accident_coordinates_set), RISK_LOADING_NUMBER):
+        traffic_accident_cells = direction.traffic_accident_cells
+        earthquake_cells = direction.earthquake_cells
+        if not is_streaming(request):
             try:
-                traffic_accident_coordinates = traffic_accident_coordinates_set[loading_index: loading_index + RISK_LOADING_NUMBER]
-            except:
-                traffic_accident_coordinates = traffic_accident_coordinates_set[loading_index:]
-
-            direction = Direction(traffic_accident_coordinates)
-            traffic_accident_number += direction.traffic_accident.number
-            traffic_accident_fatality += direction.traffic_accident.total_fatality
-            traffic_accident_injury += direction.traffic_accident.total_injury
-
-            if earthquake_flag:
-                try:
-                    earthquake_coordinates = earthquake_coordinates_set[loading_index: loading_index + RISK_LOADING_NUMBER]
-                except:
-                    earthquake_coordinates = earthquake_coordinates_set[loading_index:]
-                    earthquake_flag = False
-
-                direction = Direction(earthquake_coordinates)
-
-                if direction.earthquake.data:
-                    earthquake_number += direction.earthquake.number
-                    earthquake_magnitudes += direction.earthquake.magnitude
-                    earthquake_depths += direction.earthquake.depth
-                for i in range(direction.earthquake.number):
-                    earthquake_data.append({
-                        "date": direction.earthquake.date[i],
-                        "coordinate": direction.earthquake.coordinate[i],
-                        "magnitude": direction.earthquake.magnitude[i],
-                        "depth": direction.earthquake.depth[i],
-                    })
-
-                try:
-                    earthquake_average_magnitude = f"{average_magnitude(earthquake_magnitudes):.2f}"
-                    earthquake_average_depth = f"{average_depth(earthquake_depths):.2f}"
-                except:
-                    earthquake_average_magnitude = None
-                    earthquake_average_depth = None
-
-            data = {
-                "traffic_accident_number": traffic_accident_number,
-                "traffic_accident_fatality": traffic_accident_fatality,
-                "traffic_accident_injury": traffic_accident_injury,
-                "earthquake_number": earthquake_number,
-                "earthquake_average_magnitude": earthquake_average_magnitude,
-                "earthquake_average_depth": earthquake_average_depth,
-                "earthquake_data": earthquake_data
-            }
+                cache_key, data = await get_route_risk(traffic_accident_cells, earthquake_cells, view="map")
+            except ExecutorBusyError as e:
+                return busy_response(e)
+            return JsonResponse(data)
 
-        return JsonResponse(data)
+        # Write the running totals after each chunk, so the map can show the
+        # risk of long routes before the last chunk is looked up
+        try:
+            cache_key, data = await run_in_risk_executor(get_cached_route_risk, traffic_accident_cells,
+                                                         earthquake_cells, "map", task_type="route_cache")
+        except ExecutorBusyError as e:
+            return busy_response(e)
+        if data is not None:
+            lines = [json.dumps({**data, "done": True}) + "\n"]
+        elif isinstance(request, ASGIRequest):
+            lines = astream_map_risk(aroute_risks(traffic_accident_cells, earthquake_cells), cache_key)
+        else:
+            lines = stream_map_risk(route_risks(traffic_accident_cells, earthquake_cells), cache_key)
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
     else:
         context = {'api_key': GOOGLE_MAPS_API_KEY}
@@ -150,7 +261,7 @@ def travel(request):
             return render(request, 'travel.html', {'cities': cities})
 
 
-def travel_map(request):
+async def travel_map(request):
     if request.method == 'POST':
         start = request.POST.get('start', '')
         end = request.POST.get('end', '')
@@ -161,40 +272,20 @@ def travel_map(request):
             if not coordinates:
                 raise ValueError('No coordinates provided')
             coordinates = json.loads(coordinates)
-        except (json.JSONDecodeError, ValueError) as e:
+            direction = await run_in_risk_executor(get_direction, coordinates, get_buffer_m(request),
+                                                   task_type="route_cells")
+        except ExecutorBusyError as e:
+            return busy_response(e)
+        except (json.JSONDecodeError, ValueError, KeyError, TypeError, InvalidCoordinateError) as e:
             print('Error:', str(e))
             return JsonResponse({'error': 'Invalid coordinates format or no coordinates provided'}, status=400)
 
-        direction = Direction(coordinates)
-
-        traffic_accident_number = direction.traffic_accident.number
-        traffic_accident_fatality = direction.traffic_accident.total_fatality
-        traffic_accident_injury = direction.traffic_accident.total_injury
-
-        if direction.earthquake.data:
-            earthquake_number = direction.earthquake.number
-            earthquake_average_magnitude = f"{direction.earthquake.average_magnitude:.2f}"
-            earthquake_average_depth = f"{direction.earthquake.average_depth:.1f}"
-        else:
-            earthquake_number = 0
-            earthquake_average_magnitude = None
-            earthquake_average_depth = None
-        earthquake_data = [{
-            "date": direction.earthquake.date[i],
-            "coordinate": direction.earthquake.coordinate[i],
-            "magnitude": direction.earthquake.magnitude[i],
-            "depth": direction.earthquake.depth[i],
-        } for i in range(earthquake_number)]
-
-        return JsonResponse({
-            "traffic_accident_number": traffic_accident_number,
-            "traffic_accident_fatality": traffic_accident_fatality,
-            "traffic_accident_injury": traffic_accident_injury,
-            "earthquake_number": earthquake_number,
-            "earthquake_average_magnitude": earthquake_average_magnitude,
-            "earthquake_average_depth": earthquake_average_depth,
-            "earthquake_data": earthquake_data
-        })
+        try:
+            cache_key, data = await get_route_risk(direction.traffic_accident_cells, direction.earthquake_cells,
+                                                   view="travel_map", depth_format=".1f")
+        except ExecutorBusyError as e:
+            return busy_response(e)
+        return JsonResponse(data)
     else:
         start = request.GET.get('start', '')
         end = request.GET.get('end', '')
@@ -209,6 +300,22 @@ def travel_map(request):
 
         return render(request, 'travel_map.html', context)
 
+@staff_member_required
+def risk_stats(request):
+    """This method is used to show the metrics of the risk caches, executor
+        and connection pool of this worker to staff users only."""
+
+    return JsonResponse({
+        "route_cache": ROUTE_CACHE.stats(),
+        "route_single_flight": ROUTE_SINGLE_FLIGHT.stats(),
+        "traffic_accident_cell_cache": TRAFFIC_ACCIDENT_CELL_CACHE.stats(),
+        "earthquake_cell_cache": EARTHQUAKE_CELL_CACHE.stats(),
+        "traffic_accident_cell_filter": TRAFFIC_ACCIDENT_CELL_FILTER.stats(),
+        "earthquake_cell_filter": EARTHQUAKE_CELL_FILTER.stats(),
+        "risk_executor": RISK_EXECUTOR.stats(),
+        "connection_pool": CONNECTION_POOL.stats(),
+    })
+
 def signin(request):
     if request.method == "GET":
         return render(request, "signin.html", {})
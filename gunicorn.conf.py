@@ -0,0 +1,12 @@
+"""
+Gunicorn hooks of the workers, which are loaded by 'gunicorn safepath.wsgi'
+from the working directory
+"""
+import sys
+
+
+def worker_exit(server, worker):
+    # Close the pooled SQLite connections of 'explorer.database' cleanly
+    database = sys.modules.get("explorer.database")
+    if database is not None:
+        database.close_all_connections()
@@ -63,80 +63,123 @@ function calculateAndDisplayRoute(start, destination) {
             const coordinatesString = JSON.stringify(coordinates);
             console.log('Coordinates JSON String:', coordinatesString);
 
-            // Send coordinates to the server
-            $.ajax({
-                url: '',  // Ensure this URL points to the correct endpoint
-                type: 'POST',
-                data: {
-                    start: start,
-                    destination: destination,
-                    coordinates: coordinatesString,
-                    csrfmiddlewaretoken: $('input[name="csrfmiddlewaretoken"]').val()
-                },
-                success: function(response) {
-                    console.log('Server response:', response);  // Log server response
-                    $('#display-info').html('');
-                    $('#display-info-traffic-accident').html('');
-                    $('#display-info-earthquake').html('');
-
-                    if (response.traffic_accident_number) {
-                        $('#display-info-traffic-accident').show();
-                        $('#display-info-traffic-accident').append('<p>事故次數: ' + response.traffic_accident_number + ' 次</p>');
-                    }
-                    if (response.traffic_accident_fatality) {
-                        $('#display-info-traffic-accident').append('<p>死亡人數: ' + response.traffic_accident_fatality + ' 人</p>');
-                    }
-                    if (response.traffic_accident_injury) {
-                        $('#display-info-traffic-accident').append('<p>受傷人數: ' + response.traffic_accident_injury + ' 人</p>');
-                    }
-                    if (response.earthquake_number) {
-                        $('#display-info-earthquake').show();
-                        $('#display-info-earthquake').append('<p>地震次數: ' + response.earthquake_number + ' 次</p>');
-                        $('#display-info-earthquake').append('<p>平均規模: ' + response.earthquake_average_magnitude + '</p>');
-                        $('#display-info-earthquake').append('<p>平均深度: ' + response.earthquake_average_depth + ' 公里</p>');
-                        $('#section-earthquake-title').show();
-                        let hasMajorEarthquake = false;
-                        response.earthquake_data.forEach(data => {
-                        if (data.magnitude >= 4){
-                            $('#display-info-earthquake-list').append(
-                                '<div class="earthquake-item"' +
-                                '<p>日期: ' + data.date + '</p>' +
-                                '<p>位置: (' + data.coordinate[0] + ', ' + data.coordinate[1] + ')</p>' +
-                                '<p>芮氏規模: ' + data.magnitude + '</p>' +
-                                '<p>深度: ' + data.depth + ' 公里</p>'+
-                                '</div>'
-                            );
-                            $('#display-info-earthquake-list').show();
-                            hasMajorEarthquake = true;
-                        }
-                    });
-
-                    if(!hasMajorEarthquake){
-                        // console.log("nonelist")
-                        $('#display-info-earthquake-none-list').append(
-                            '<div class="earthquake-item"' +
-                            '<p>該路段無規模4.0以上地震</p>' +
-                            '</div>'
-                        );
-                        $('#display-info-earthquake-none-list').show();
+            // Send coordinates to the server and render the running risk
+            // totals of each line of the streamed response
+            const body = new URLSearchParams({
+                start: start,
+                destination: destination,
+                coordinates: coordinatesString,
+                stream: '1',
+                csrfmiddlewaretoken: $('input[name="csrfmiddlewaretoken"]').val()
+            });
+            resetRisk();
+            fetch('', {method: 'POST', body: body, headers: {'Accept': 'application/x-ndjson'}})
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(response.status + ' ' + response.statusText);
                     }
-                    } else {
-                        // $('#display-info-earthquake').show();
-                        $('#display-info-earthquake').append('<p>無地震紀錄</p>');
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffered = '';
+                    function read() {
+                        return reader.read().then(({done, value}) => {
+                            buffered += decoder.decode(value || new Uint8Array(), {stream: !done});
+                            const lines = buffered.split('\n');
+                            buffered = lines.pop();
+                            lines.filter(line => line.trim()).forEach(line => displayRisk(JSON.parse(line)));
+                            if (!done) {
+                                return read();
+                            }
+                        });
                     }
-                    $('#loading-message').hide();
-                },
-                error: function(xhr, status, error) {
-                    console.log('AJAX Error:', status, error);
-                    console.log('Response:', xhr.responseText);
+                    return read();
+                })
+                .catch(error => {
+                    console.log('Fetch Error:', error);
                     $('#loading-message').hide();
                     $('#display-info').html('<p>An error occurred while processing your request.</p>');
-                }
-            });
+                });
         } else {
             console.log('Directions request failed due to ' + status);
         }
     });
 }
 
-initMap();
\ No newline at end of file
+initMap();
+// The earthquakes of a streamed response which are already listed. Each
+// line only has the earthquakes of its chunk, and the last line has every
+// earthquake of the route, so only the ones not listed yet are added.
+let shownEarthquakeNumber = 0;
+let hasMajorEarthquake = false;
+
+function resetRisk() {
+    shownEarthquakeNumber = 0;
+    hasMajorEarthquake = false;
+    $('#display-info-earthquake-list').html('');
+    $('#display-info-earthquake-none-list').html('');
+}
+
+function displayRisk(response) {
+    console.log('Server response:', response);  // Log server response
+    if (response.error) {
+        // The last line of a stream which failed after it started
+        $('#loading-message').hide();
+        $('#display-info').html('<p>' + response.error + '</p>');
+        return;
+    }
+    $('#display-info').html('');
+    $('#display-info-traffic-accident').html('');
+    $('#display-info-earthquake').html('');
+
+    if (response.traffic_accident_number) {
+        $('#display-info-traffic-accident').show();
+        $('#display-info-traffic-accident').append('<p>事故次數: ' + response.traffic_accident_number + ' 次</p>');
+    }
+    if (response.traffic_accident_fatality) {
+        $('#display-info-traffic-accident').append('<p>死亡人數: ' + response.traffic_accident_fatality + ' 人</p>');
+    }
+    if (response.traffic_accident_injury) {
+        $('#display-info-traffic-accident').append('<p>受傷人數: ' + response.traffic_accident_injury + ' 人</p>');
+    }
+    if (response.earthquake_number) {
+        $('#display-info-earthquake').show();
+        $('#display-info-earthquake').append('<p>地震次數: ' + response.earthquake_number + ' 次</p>');
+        $('#display-info-earthquake').append('<p>平均規模: ' + response.earthquake_average_magnitude + '</p>');
+        $('#display-info-earthquake').append('<p>平均深度: ' + response.earthquake_average_depth + ' 公里</p>');
+        $('#section-earthquake-title').show();
+        const earthquakes = response.done
+            ? response.earthquake_data.slice(shownEarthquakeNumber)
+            : response.earthquake_data;
+        shownEarthquakeNumber += earthquakes.length;
+        earthquakes.forEach(data => {
+        if (data.magnitude >= 4){
+            $('#display-info-earthquake-list').append(
+                '<div class="earthquake-item"' +
+                '<p>日期: ' + data.date + '</p>' +
+                '<p>位置: (' + data.coordinate[0] + ', ' + data.coordinate[1] + ')</p>' +
+                '<p>芮氏規模: ' + data.magnitude + '</p>' +
+                '<p>深度: ' + data.depth + ' 公里</p>'+
+                '</div>'
+            );
+            $('#display-info-earthquake-list').show();
+            hasMajorEarthquake = true;
+        }
+    });
+
+    if(!hasMajorEarthquake && response.done){
+        // console.log("nonelist")
+        $('#display-info-earthquake-none-list').append(
+            '<div class="earthquake-item"' +
+            '<p>該路段無規模4.0以上地震</p>' +
+            '</div>'
+        );
+        $('#display-info-earthquake-none-list').show();
+    }
+    } else if (response.done) {
+        // $('#display-info-earthquake').show();
+        $('#display-info-earthquake').append('<p>無地震紀錄</p>');
+    }
+    if (response.done) {
+        $('#loading-message').hide();
+    }
+}